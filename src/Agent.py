@@ -0,0 +1,117 @@
+from collections.abc import Callable
+from json import JSONDecodeError, dumps, loads
+from logging import getLogger
+from os import remove, umask
+from os.path import exists
+from socket import SOCK_STREAM, socket
+from time import monotonic
+
+try:
+    from socket import AF_UNIX
+except ImportError:
+    AF_UNIX = None  # Windows, there is no agent there
+
+from assets import AGENT_CLIENT_TIMEOUT
+
+logger = getLogger(__name__)
+
+
+class Agent:
+    """
+    Keeps the data of a user unlocked and answers requests on a Unix socket that only
+    the user can access. One JSON object per line in both directions, the requests
+    `ping` and `lock` are answered here, all others by `handle`.
+    """
+
+    def __init__(self, path: str, handle: Callable[[dict], dict], ttl: int = 0) -> None:
+        self.path = path
+        self.handle = handle
+        self.deadline = None if ttl == 0 else monotonic() + ttl
+        self.is_locked = False
+        if call_agent(path, {"op": "ping"}) is not None:
+            raise Exception("An agent is already running for this user")
+        if exists(path):
+            remove(path)  # left behind by an agent that didn't stop cleanly
+        self.server = socket(AF_UNIX, SOCK_STREAM)
+        old_umask = umask(0o177)  # the socket is created with the mode 600
+        try:
+            self.server.bind(path)
+        finally:
+            umask(old_umask)
+        self.server.listen()
+
+    def get_remaining_time(self) -> float | None:
+        return None if self.deadline is None else max(self.deadline - monotonic(), 0)
+
+    def serve(self) -> None:
+        """
+        Answer requests until the agent gets locked or its time runs out
+        """
+        try:
+            while not self.is_locked:
+                if (remaining := self.get_remaining_time()) == 0:
+                    logger.info("The agent locked itself after its time ran out")
+                    return
+                self.server.settimeout(remaining)
+                try:
+                    connection, _ = self.server.accept()
+                except TimeoutError:
+                    continue
+                with connection:
+                    self.handle_connection(connection)
+        finally:
+            self.server.close()
+            if exists(self.path):
+                remove(self.path)
+
+    def handle_connection(self, connection: socket) -> None:
+        connection.settimeout(AGENT_CLIENT_TIMEOUT)
+        try:
+            with connection.makefile("rwb") as f:
+                for line in f:
+                    f.write(dumps(self.answer(line)).encode() + b"\n")
+                    f.flush()
+                    if self.is_locked:
+                        return
+        except OSError as e:
+            logger.info(f"A connection to the agent broke: {e}")
+
+    def answer(self, line: bytes) -> dict:
+        try:
+            request = loads(line)
+        except JSONDecodeError:
+            return {"error": "Every request has to be a JSON object"}
+        match request.get("op"):
+            case "ping":
+                return {"remaining": self.get_remaining_time()}
+            case "lock":
+                self.is_locked = True
+                logger.info("The agent got locked")
+                return {"locked": True}
+        try:
+            return self.handle(request)
+        except Exception as e:
+            logger.critical(e)
+            return {"error": str(e)}
+
+
+def call_agent(path: str, request: dict) -> dict | None:
+    """
+    Send a request to the agent at `path`, None if there is none running
+    """
+    if not exists(path):
+        return
+    try:
+        with socket(AF_UNIX, SOCK_STREAM) as client:
+            client.settimeout(AGENT_CLIENT_TIMEOUT)
+            client.connect(path)
+            client.settimeout(None)  # the first search of the agent may take longer
+            with client.makefile("rwb") as f:
+                f.write(dumps(request).encode() + b"\n")
+                f.flush()
+                response = f.readline()
+    except OSError:
+        return
+    if response == b"":
+        return
+    return loads(response)
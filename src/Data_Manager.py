@@ -1,28 +1,91 @@
 # Security packets
 # Other packets
-from base64 import urlsafe_b64encode, b64encode, b64decode
+from base64 import urlsafe_b64decode, urlsafe_b64encode, b64encode, b64decode
+from collections.abc import Iterable, Iterator, MutableMapping
+from contextlib import contextmanager
 from datetime import datetime
-from json import loads
+from functools import wraps
+from hashlib import sha256
+from hmac import compare_digest
+from json import dumps, loads
 from logging import getLogger
-from os.path import exists, join, split, splitext
+from os import cpu_count, fsync, listdir, makedirs, remove, replace, urandom
+from os.path import basename, exists, getsize, isdir, join, split, splitext
 from secrets import choice
+from shutil import rmtree
 from string import ascii_letters, digits, punctuation
+from struct import Struct
+from threading import RLock
+from time import monotonic, perf_counter
+from typing import BinaryIO
 from uuid import uuid4
 
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from prettytable import PrettyTable
 
-from assets import DEFAULT_SCHEMES
+try:
+    from argon2.low_level import Type, hash_secret_raw
+except ImportError:
+    hash_secret_raw = None
+
+try:
+    from fcntl import LOCK_EX, LOCK_SH, flock
+except ImportError:
+    flock = None  # Windows, the sessions of a user aren't coordinated there
+
+from assets import (
+    BACKUP_GENERATIONS,
+    DEFAULT_KDF_SETTINGS,
+    DEFAULT_SCHEMES,
+    JOURNAL_COMPACTION_THRESHOLD,
+    KDF_HEADER_VERSION,
+    MAX_SCRYPT_N,
+    MIN_KDF_PARAMS,
+    SEGMENT_SIZE,
+)
+from Finder import SearchIndex
+from Query import QueryIndex
+from Serializer import deserialize, serialize
+from Table import format_row, format_table, get_column_widths
 
 logger = getLogger(__name__)
 
+FILE_MAGIC = b"ONIGUARD"
+FILE_VERSION = b"\x03"
+# snapshots and journals that start with the generation of the snapshot
+GENERATION_VERSION = b"\x04"
+GENERATION = Struct("<Q")
+FRAME_HEADER = Struct("<I")  # length of the frame
+# written once all files of a rekey are complete, the old ones are replaced after it
+REKEY_COMMIT = ".rekey.commit"
+SEGMENT_HEADER = Struct("<I?")  # length of the segment and if it is the last one
+
 
 class Cryptographer:
+    """
+    Encrypts the records of the files with AES-GCM. Data that doesn't fit into one record
+    is split into segments of SEGMENT_SIZE (STREAM construction), so every segment is
+    authenticated on its own and a truncated or reordered stream is detected as well.
+    Fernet is only used to read files of older versions.
+    """
+
     def __init__(self, key: bytes) -> None:
         try:
             self.fernet = Fernet(key)
+            self.aes = AESGCM(
+                HKDF(
+                    algorithm=hashes.SHA256(),
+                    length=32,
+                    salt=None,
+                    info=b"oniguard records",
+                ).derive(urlsafe_b64decode(key))
+            )
         except Exception as e:
             logger.info(
                 "Keyfile doesn't exist or someting else went wrong. For more detail see the error below."
@@ -34,93 +97,1099 @@ class Cryptographer:
         key = Fernet.generate_key()
         return key
 
-    def encrypt(self, data: str) -> bytes | None:
+    def encrypt(self, data: bytes, aad=b"") -> bytes | None:
         try:
-            return self.fernet.encrypt(data.encode())
+            nonce = urandom(12)
+            return nonce + self.aes.encrypt(nonce, data, aad)
         except Exception as e:
             logger.critical(e)
 
-    def decrypt(self, data: str) -> str | None:
+    def decrypt(self, data: bytes, aad=b"") -> bytes | None:
         try:
-            return self.fernet.decrypt(data).decode()
+            return self.aes.decrypt(data[:12], data[12:], aad)
         except Exception as e:
             logger.critical(e)
 
+    def decrypt_legacy(self, data: str | bytes) -> bytes | None:
+        try:
+            return self.fernet.decrypt(data)
+        except Exception as e:
+            logger.critical(e)
+
+    def encrypt_stream(self, chunks: Iterable[bytes], f: BinaryIO, aad=b"") -> bytes:
+        """
+        Encrypt the chunks into segments of SEGMENT_SIZE, write them to the file and
+        return the random nonce prefix of the stream
+        """
+        prefix = urandom(7)
+        f.write(prefix)
+        buffer, counter = bytearray(), 0
+        for chunk in chunks:
+            buffer += chunk
+            # keep the rest, the last segment has to be written with the last flag
+            while len(buffer) > SEGMENT_SIZE:
+                self.write_segment(f, prefix, counter, buffer[:SEGMENT_SIZE], aad)
+                del buffer[:SEGMENT_SIZE]
+                counter += 1
+        self.write_segment(f, prefix, counter, buffer, aad, last=True)
+        return prefix
+
+    def write_segment(
+        self, f: BinaryIO, prefix: bytes, counter: int, data: bytes, aad, last=False
+    ) -> None:
+        nonce = prefix + counter.to_bytes(4, "big") + (b"\x01" if last else b"\x00")
+        segment = self.aes.encrypt(nonce, bytes(data), aad)
+        f.write(SEGMENT_HEADER.pack(len(segment), last))
+        f.write(segment)
+
+    def decrypt_stream(self, f: BinaryIO, aad=b"") -> Iterator[bytes]:
+        """
+        Read and decrypt the segments written by `encrypt_stream` one after another
+        """
+        prefix, counter = f.read(7), 0
+        while True:
+            header = f.read(SEGMENT_HEADER.size)
+            if len(prefix) != 7 or len(header) != SEGMENT_HEADER.size:
+                logger.critical(f"The stream ended before segment {counter}.")
+                raise Exception("Truncated stream")
+            length, last = SEGMENT_HEADER.unpack(header)
+            nonce = prefix + counter.to_bytes(4, "big") + (b"\x01" if last else b"\x00")
+            try:
+                yield self.aes.decrypt(nonce, f.read(length), aad)
+            except InvalidTag:
+                if counter == 0:
+                    logger.critical(
+                        "Wrong password provided or something else went wrong."
+                    )
+                    raise Exception("Wrong Password")
+                logger.critical(f"Segment {counter} of the stream is corrupted.")
+                raise Exception("Corrupted stream")
+            if last:
+                return
+            counter += 1
+
+
+class EntryStore(MutableMapping):
+    """
+    The entries of the vault. Every entry is stored as its own encrypted record and only
+    decrypted when its values are accessed. The scheme of an entry is known without that.
+    """
+
+    def __init__(
+        self,
+        crypt: Cryptographer,
+        index: dict,
+        tokens: dict,
+        entries: dict | None = None,
+    ) -> None:
+        self.crypt = crypt
+        self.index: dict[str, str] = index  # entry hash -> scheme hash
+        self.tokens: dict[str, bytes] = tokens  # entry hash -> encrypted values
+        # entry hash -> decrypted entry
+        self.entries: dict[str, dict] = entries if entries is not None else {}
+
+    def __getitem__(self, hash: str) -> dict:
+        if hash not in self.entries:
+            if hash not in self.index:
+                raise KeyError(hash)
+            self.entries[hash] = {
+                "scheme_hash": self.index[hash],
+                "values": self.read_values(hash),
+            }
+        return self.entries[hash]
+
+    def __setitem__(self, hash: str, entry: dict) -> None:
+        self.index[hash] = entry["scheme_hash"]
+        self.entries[hash] = entry
+        self.tokens.pop(hash, None)
+
+    def __delitem__(self, hash: str) -> None:
+        del self.index[hash]
+        self.entries.pop(hash, None)
+        self.tokens.pop(hash, None)
+
+    def __contains__(self, hash: object) -> bool:
+        return hash in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get_scheme_hash(self, hash: str) -> str:
+        return self.index[hash]
+
+    def read_values(self, hash: str) -> list:
+        """
+        The values of an entry, decrypted without keeping them
+        """
+        if hash in self.entries:
+            return self.entries[hash]["values"]
+        values = self.crypt.decrypt(self.tokens[hash], hash.encode())
+        if values is None:
+            raise Exception(f"Couldn't decrypt the entry {hash}")
+        return deserialize(values)
+
+    def get_token(self, hash: str) -> bytes | None:
+        """
+        The encrypted record of an entry, unchanged entries are not encrypted again
+        """
+        if hash not in self.tokens:
+            content = self.crypt.encrypt(serialize(self[hash]["values"]), hash.encode())
+            if content is None:
+                return
+            self.tokens[hash] = content
+        return self.tokens[hash]
+
+
+def get_scheme_key(columns: list) -> tuple:
+    """
+    The columns of a scheme (without the hidden date columns) in a hashable form
+    """
+    return tuple(tuple(i) for i in columns)
+
+
+def synchronized(method):
+    """
+    Hold the mutex of the data while the method runs, so saves in the background never
+    see a change halfway through
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.mutex:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def locked(method):
+    """
+    Hold the lock of the files while the method runs, so other sessions of the user
+    wait for it. It is always taken before the mutex.
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.locked_files():
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def get_record_key(record: list | tuple) -> str:
+    """
+    What a journal record changes: an entry, a scheme or the settings
+    """
+    return "settings" if record[0] == "set_settings" else record[1]
+
+
+def write_frame(f: BinaryIO, data: bytes) -> None:
+    f.write(FRAME_HEADER.pack(len(data)))
+    f.write(data)
+
+
+def read_frame(f: BinaryIO) -> bytes | None:
+    """
+    Read the next frame of a file, None at the end of the file or for an incomplete frame
+    """
+    header = f.read(FRAME_HEADER.size)
+    if len(header) != FRAME_HEADER.size:
+        return
+    (length,) = FRAME_HEADER.unpack(header)
+    data = f.read(length)
+    if len(data) != length:
+        return
+    return data
+
 
 class FileManager:
     """
-    A class that manages a JSON file and the respective backup file
+    A class that manages a JSON file and the respective backups
+
+    The file starts with FILE_MAGIC, the version and the generation, followed by the
+    encrypted index (settings, schemes and the scheme of every entry) as a segment stream.
+    After that every entry has its own frame holding its hash and its encrypted values.
+
+    Several sessions can use the same files. Every write holds the lock of the files, the
+    journal is shared and every new snapshot gets the next generation. Before a session
+    writes a snapshot it takes over what the others saved (see `merge_changes`).
     """
 
     def __init__(self, path_to_file: str, key: bytes) -> None:
+        self.mutex = RLock()  # the data is saved on another thread (see Renderer.save)
+        self.file_mutex = RLock()  # the threads of this session wait for each other
+        self.lock_file: BinaryIO | None = None
+        self.lock_depth = 0
+        self.generation = 0
         if not exists(path_to_file):
             logger.critical("File not found in given directory.")
             logger.info(f"Therefore a file was created at {path_to_file}")
             self.for_new_file(path_to_file, key)
             return
         self.crypt = Cryptographer(key)
+        self.key: bytes = key
         self.path_to_file: str = path_to_file
         self.backup_path: str = splitext(path_to_file)[0] + ".backup"
-        self.data: dict = self.read_file_data()
+        self.backup_folder: str = splitext(path_to_file)[0] + ".backups"
+        self.journal_path: str = splitext(path_to_file)[0] + ".journal"
+        self.search_path: str = splitext(path_to_file)[0] + ".search"
+        self.lock_path: str = splitext(path_to_file)[0] + ".lock"
+        self.pending: list = []
+        self.snapshot_id: str = ""
+        # the end of the journal records that are part of the data
+        self.journal_offset = 0
+        self.is_journal_damaged = False  # see read_journal
+        # the files have a format of an older version, the next snapshot converts them
+        self.is_outdated = False
+        # the salt and key derivation settings the key of this session belongs to
+        self.key_header = read_key_header(split(path_to_file)[0])
+        # entries that changed since the snapshot, the persisted search index misses them
+        self.changed_entries: set[str] = set()
+        self.search_index: SearchIndex | None = None
+        self.query_index: QueryIndex | None = None
+        with self.locked_files(shared=True):
+            self.data: dict = self.read_file_data()
+            self.build_scheme_index()
+            self.journal_size: int = self.replay_journal()
 
     def for_new_file(self, path_with_filename_and_extension: str, key: bytes) -> None:
         """
         Alternative constructor for when the JSON file doesn't exist yet
         """
-        crypt = Cryptographer(key)
-        default_content = f'{{"settings":{{"dates_hidden":[true, true], "hidden_schemes": []}},"schemes": {DEFAULT_SCHEMES}, "entries": {{}}}}'
-        with open(path_with_filename_and_extension, "wb") as f:
-            if (content := crypt.encrypt(default_content)) is None:
-                return
-            f.write(content)
+        self.crypt = Cryptographer(key)
+        self.data = {
+            "settings": {"dates_hidden": [True, True], "hidden_schemes": []},
+            "schemes": DEFAULT_SCHEMES,
+            "entries": EntryStore(self.crypt, {}, {}),
+        }
+        self.write_snapshot(path_with_filename_and_extension, 0)
         return
 
+    @contextmanager
+    def locked_files(self, shared=False):
+        """
+        Hold the advisory lock of the files (a shared one for reading). The threads of
+        this session can take it again while they hold it.
+        """
+        with self.file_mutex:
+            if flock is not None and (self.lock_depth == 0 or not shared):
+                if self.lock_file is None:
+                    self.lock_file = open(self.lock_path, "ab")
+                # a shared lock is converted when an exclusive one is needed
+                flock(self.lock_file.fileno(), LOCK_SH if shared else LOCK_EX)
+            self.lock_depth += 1
+            try:
+                yield
+            finally:
+                self.lock_depth -= 1
+                if self.lock_depth == 0 and self.lock_file is not None:
+                    self.lock_file.close()  # releases the lock
+                    self.lock_file = None
+
     def read_file_data(self) -> dict:
         """
         Read JSON file and move contents into dictionary
         """
-        with open(self.path_to_file, "r") as f:
-            data = self.crypt.decrypt(f.readline())
-            if data is not None:
-                return loads(data.replace("'", '"'))
+        return self.read_snapshot(self.path_to_file)
+
+    def read_snapshot(self, path: str) -> dict:
+        """
+        Read the index of a snapshot, the entries stay encrypted until they are needed.
+        Entries whose record is damaged or missing (an incomplete record at the end) are
+        left out, so the others can still be used and written again.
+        """
+        with open(path, "rb", buffering=SEGMENT_SIZE) as f:
+            if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                f.seek(0)
+                if path == self.path_to_file:
+                    self.is_outdated = True
+                return self.read_legacy_snapshot(f)
+            if (version := f.read(1)) not in (FILE_VERSION, GENERATION_VERSION):
+                logger.critical(f"Unsupported file version {version}")
+                raise Exception("Unsupported file version")
+            generation, aad = 0, b"index"
+            if version == GENERATION_VERSION:
+                header = f.read(GENERATION.size)
+                (generation,) = GENERATION.unpack(header)
+                aad += header
+            if path == self.path_to_file:
+                self.generation = generation
+                self.is_outdated = version != GENERATION_VERSION
+                # the nonce prefix of the index is random for every snapshot
+                self.snapshot_id = f.read(7).hex()
+                f.seek(-7, 1)
+            data = deserialize(b"".join(self.crypt.decrypt_stream(f, aad)))
+            index, hidden = data["entries"], set(data["settings"]["hidden_schemes"])
+            tokens, decrypted, end = {}, {}, f.tell()
+            while (frame := read_frame(f)) is not None:
+                end = f.tell()
+                hash_length = frame[0]
+                hash = frame[1 : hash_length + 1].decode(errors="replace")
+                token = frame[hash_length + 1 :]
+                if (values := self.crypt.decrypt(token, hash.encode())) is None:
+                    logger.critical(f"The record of the entry {hash} is damaged")
+                    continue
+                tokens[hash] = token
+                # the others are displayed right away (hidden ones stay encrypted)
+                if hash in index and index[hash] not in hidden:
+                    decrypted[hash] = {
+                        "scheme_hash": index[hash],
+                        "values": deserialize(values),
+                    }
+            if end != getsize(path):
+                logger.critical(
+                    f"The snapshot ends with an incomplete record, it was read up to byte {end}"
+                )
+        self.leave_out_unreadable(data["entries"], tokens)
+        data["entries"] = EntryStore(self.crypt, data["entries"], tokens, decrypted)
+        return data
+
+    def leave_out_unreadable(self, index: dict, tokens: dict) -> None:
+        """
+        Remove the entries without a (readable) record from the index
+        """
+        for hash in [i for i in index if i not in tokens]:
+            logger.critical(f"Left out the entry {hash}, its record can't be read")
+            del index[hash]
+
+    def read_legacy_snapshot(self, f: BinaryIO) -> dict:
+        """
+        Read the Fernet encrypted files of older versions, they get converted on the next save
+        """
+        if (index := self.crypt.decrypt_legacy(f.readline().strip())) is None:
+            logger.critical("Wrong password provided or something else went wrong.")
+            raise Exception("Wrong Password")
+        try:
+            data = deserialize(index)
+        except ValueError:
+            # the first versions wrote the data with `str()`
+            data = loads(index.decode().replace("'", '"'))
+        entries = EntryStore(self.crypt, {}, {})
+        if data.get("version") != 2:
+            # all entries (with their values) are part of the index
+            for hash, entry in data["entries"].items():
+                entries[hash] = entry
+        else:
+            # one line per entry in the form `<entry hash> <encrypted values>`
+            for line in f:
+                if line.strip() == b"":
+                    continue
+                hash, token = line.decode().split(" ", 1)
+                if (values := self.crypt.decrypt_legacy(token.strip())) is None:
+                    logger.critical(f"Left out the entry {hash}, its record is damaged")
+                    continue
+                entries[hash] = {
+                    "scheme_hash": data["entries"][hash],
+                    "values": deserialize(values),
+                }
+        data["entries"] = entries
+        return data
 
-        logger.critical("Wrong password provided or something else went wrong.")
-        raise Exception("Wrong Password")
+    def write_snapshot(self, path: str, generation: int) -> str | None:
+        """
+        Write the index and the records of all entries to a file (atomically) and
+        return the id of the snapshot
+        """
+        entries = self.data["entries"]
+        index = {
+            "settings": self.data["settings"],
+            "schemes": self.data["schemes"],
+            "entries": entries.index,
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb", buffering=SEGMENT_SIZE) as f:
+            header = GENERATION.pack(generation)
+            f.write(FILE_MAGIC + GENERATION_VERSION + header)
+            snapshot_id = self.crypt.encrypt_stream(
+                [serialize(index)], f, b"index" + header
+            )
+            for hash in entries:
+                if (token := entries.get_token(hash)) is None:
+                    return
+                encoded_hash = hash.encode()
+                write_frame(f, bytes([len(encoded_hash)]) + encoded_hash + token)
+            f.flush()
+            fsync(f.fileno())
+        replace(tmp_path, path)
+        return snapshot_id.hex()
+
+    def replay_journal(self) -> int:
+        """
+        Apply the changes of the journal on top of the snapshot and return the amount of records
+        """
+        if not exists(self.journal_path):
+            return 0
+        with open(self.journal_path, "rb", buffering=SEGMENT_SIZE) as f:
+            if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                # journals of older versions have one Fernet token per line
+                f.seek(0)
+                for num_records, line in enumerate(f):
+                    if (record := self.crypt.decrypt_legacy(line.strip())) is None:
+                        logger.critical(
+                            f"Stopped replaying the journal at record {num_records}."
+                        )
+                        break
+                    self.apply_record(deserialize(record))
+                # new records can't be appended to it, so it is converted right away
+                self.is_outdated = True
+                self.compact()
+                return 0
+        if (start := self.get_journal_start(self.generation)) is None:
+            # the snapshot was written, but the journal before it wasn't removed (crash)
+            return 0
+        records = self.read_journal(start)
+        for record in records:
+            self.apply_record(record)
+        return len(records)
+
+    def get_journal_start(self, generation: int) -> int | None:
+        """
+        Where the records of the journal start, None if there is no journal that belongs
+        to the snapshot of this generation
+        """
+        if not exists(self.journal_path):
+            return
+        with open(self.journal_path, "rb") as f:
+            header = f.read(len(FILE_MAGIC) + 1 + GENERATION.size)
+        if header[: len(FILE_MAGIC)] != FILE_MAGIC:
+            return
+        version = header[len(FILE_MAGIC) : len(FILE_MAGIC) + 1]
+        if version == FILE_VERSION:
+            # journals of older versions belong to whatever snapshot is there
+            return len(FILE_MAGIC) + 1
+        if (
+            version != GENERATION_VERSION
+            or len(header) != len(FILE_MAGIC) + 1 + GENERATION.size
+        ):
+            return
+        if GENERATION.unpack(header[len(FILE_MAGIC) + 1 :])[0] != generation:
+            return
+        return len(header)
+
+    def read_journal(self, offset: int) -> list:
+        """
+        Read the records of the journal from `offset` on and move `journal_offset` to
+        their end. An incomplete record at the end (a crash while it was written) is cut
+        off. At a record that can't be decrypted it stops, the journal is kept as it is.
+        """
+        records = []
+        self.journal_offset = offset
+        with open(self.journal_path, "rb", buffering=SEGMENT_SIZE) as f:
+            f.seek(offset)
+            while (frame := read_frame(f)) is not None:
+                if (record := self.crypt.decrypt(frame, b"journal")) is None:
+                    # corrupted or written with another key (e.g. before a rekey)
+                    logger.critical(
+                        f"The record at byte {self.journal_offset} of the journal can't be decrypted, the records after it are not read."
+                    )
+                    self.is_journal_damaged = True
+                    return records
+                records.append(deserialize(record))
+                self.journal_offset = f.tell()
+        if getsize(self.journal_path) != self.journal_offset:
+            logger.critical(
+                f"Stopped reading the journal at byte {self.journal_offset}, the rest is cut off."
+            )
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(self.journal_offset)
+        return records
+
+    def read_generation(self) -> int:
+        """
+        The generation of the snapshot on the disk, without reading the rest of it
+        """
+        with open(self.path_to_file, "rb") as f:
+            header = f.read(len(FILE_MAGIC) + 1 + GENERATION.size)
+        if header[len(FILE_MAGIC) : len(FILE_MAGIC) + 1] != GENERATION_VERSION:
+            return 0
+        return GENERATION.unpack(header[len(FILE_MAGIC) + 1 :])[0]
+
+    def apply_record(self, record: list) -> None:
+        """
+        Apply one journal record to the data. The records hold the new state and not the
+        operation itself, so applying one twice is harmless.
+        """
+        match record:
+            case ["set_entry", hash, entry]:
+                self.data["entries"][hash] = entry
+            case ["del_entry", hash]:
+                if hash in self.data["entries"]:
+                    del self.data["entries"][hash]
+            case ["set_scheme", hash, scheme]:
+                self.data["schemes"][hash] = scheme
+            case ["del_scheme", hash]:
+                self.data["schemes"].pop(hash, None)
+            case ["set_settings", settings]:
+                self.data["settings"] = settings
+            case _:
+                logger.critical(f"Unknown journal record {record[0]}")
+                return
+        self.update_indexes(record)
+
+    def log_change(self, *record) -> None:
+        """
+        Remember a change so it is appended to the journal on the next `update_data`
+        """
+        self.pending.append(record)
+        self.update_indexes(record)
 
     def update_data(self) -> None:
         """
-        Overwrite old data with new data
+        Append the pending changes to the journal of the snapshot on the disk (it may be
+        a newer one of another session, the records hold whole entries). The data is only
+        locked while the changes are taken, not while they are written.
         """
-        with open(self.path_to_file, "wb") as f:
-            if (
-                content := self.crypt.encrypt(str(self.data).replace("True", "true"))
-            ) is None:
+        with self.locked_files():
+            generation = self.read_generation()
+            self.check_key(generation)
+            with self.mutex:
+                if self.pending == []:
+                    return
+                records = []
+                for record in self.pending:
+                    content = self.crypt.encrypt(serialize(record), b"journal")
+                    if content is None:
+                        return
+                    records.append(content)
+                pending, self.pending = self.pending, []
+            is_new_journal = self.get_journal_start(generation) is None
+            try:
+                with open(self.journal_path, "wb" if is_new_journal else "ab") as f:
+                    if is_new_journal:
+                        f.write(FILE_MAGIC + GENERATION_VERSION)
+                        f.write(GENERATION.pack(generation))
+                    start = f.tell()
+                    for record in records:
+                        write_frame(f, record)
+                    f.flush()
+                    fsync(f.fileno())
+                    end = f.tell()
+            except OSError:
+                with self.mutex:
+                    self.pending = pending + self.pending  # written with the next save
+                raise
+            with self.mutex:
+                if generation == self.generation and (
+                    start == self.journal_offset or is_new_journal
+                ):
+                    # no other session saved something in between
+                    self.journal_offset = end
+                    self.journal_size += len(records)
+
+    def check_key(self, generation: int) -> None:
+        """
+        Refuse to go on with a snapshot (of the generation on the disk) of another
+        session that encrypted the data with a new key, see `rekey`
+        """
+        if generation == self.generation:
+            return
+        if read_key_header(split(self.path_to_file)[0]) != self.key_header:
+            logger.critical("Another session encrypted the data with a new key")
+            raise Exception(
+                "The data was encrypted with a new key in another session, open it again to save your changes"
+            )
+
+    def take_over_changes(self) -> int:
+        """
+        Apply what other sessions saved since this one read or wrote the files (they have
+        to be locked) and return the amount of records. The changes that are still
+        pending here win over the ones of the other sessions.
+        """
+        generation = self.read_generation()
+        self.check_key(generation)
+        is_reloaded = generation != self.generation
+        if is_reloaded:
+            # the snapshot of another session holds everything saved before it
+            logger.info(f"Reading the snapshot {generation} of another session")
+            self.data = self.read_file_data()
+            self.search_index, self.query_index = None, None
+            self.changed_entries = set()
+            self.build_scheme_index()
+            self.journal_offset, self.journal_size = 0, 0
+            for record in self.pending:
+                self.apply_record(record)
+        start = self.get_journal_start(generation)
+        if start is None or getsize(self.journal_path) == self.journal_offset:
+            if is_reloaded:
+                self.delete_orphaned_entries()
+            return int(is_reloaded)
+        records = self.read_journal(max(start, self.journal_offset))
+        pending = {get_record_key(i) for i in self.pending}
+        for record in records:
+            if get_record_key(record) not in pending:
+                self.apply_record(record)
+        self.journal_size += len(records)
+        self.delete_orphaned_entries()
+        return len(records) + int(is_reloaded)
+
+    def delete_orphaned_entries(self) -> None:
+        """
+        Delete the entries whose scheme is gone, e.g. the ones another session added to
+        a scheme that this one deleted
+        """
+        schemes = self.data["schemes"]
+        for scheme_hash in [i for i in self.scheme_entries if i not in schemes]:
+            for hash in list(self.scheme_entries[scheme_hash]):
+                logger.info(f"Deleted the entry {hash}, its scheme is gone")
+                del self.data["entries"][hash]
+                self.log_change("del_entry", hash)
+
+    @locked
+    @synchronized
+    def merge_changes(self) -> int:
+        """
+        Take over what other sessions saved (see `take_over_changes`) and write a new
+        snapshot when the journal grew too big
+        """
+        num_records = self.take_over_changes()
+        if self.journal_size >= JOURNAL_COMPACTION_THRESHOLD:
+            self.write_new_snapshot()
+        return num_records
+
+    @locked
+    @synchronized
+    def compact(self) -> None:
+        """
+        Write the whole data (with what other sessions saved) as a new snapshot and
+        start with an empty journal. Nothing is written when the snapshot holds all of
+        it already.
+        """
+        self.take_over_changes()
+        if (
+            self.journal_size == 0
+            and self.pending == []
+            and not self.is_journal_damaged
+            and not self.is_outdated
+        ):
+            return
+        self.write_new_snapshot()
+
+    def write_new_snapshot(self) -> None:
+        """
+        Write the snapshot of the next generation, the files have to be locked
+        """
+        if self.search_index is None:
+            # it only matches the old snapshot, so it has to be carried over now
+            self.search_index = self.load_search_index()
+        self.snapshot_id = self.write_snapshot(self.path_to_file, self.generation + 1)
+        self.generation += 1
+        self.changed_entries = set()
+        self.remove_journal()
+        self.journal_offset, self.journal_size = 0, 0
+        self.pending = []
+        self.is_outdated = False
+        self.write_search_index()
+
+    def remove_journal(self) -> None:
+        """
+        Remove the journal once its records are part of a snapshot. A journal with a
+        record that couldn't be decrypted is kept next to the data instead.
+        """
+        if self.is_journal_damaged and exists(self.journal_path):
+            path = f"{self.journal_path}.damaged-{self.generation}"
+            replace(self.journal_path, path)
+            logger.critical(f"Kept the damaged journal as {path}")
+        elif exists(self.journal_path):
+            remove(self.journal_path)
+        self.is_journal_damaged = False
+
+    # Search index
+    # The trigram index of the entries is written next to every snapshot. It is only read
+    # (or built when it doesn't match the snapshot) once it is needed for a search.
+    def get_search_index(self) -> SearchIndex:
+        if self.search_index is None:
+            self.search_index = self.load_search_index()
+        if self.search_index is None:
+            self.search_index = SearchIndex()
+            self.index_schemes()
+            for hash in self.data["entries"]:
+                self.index_entry(hash)
+        return self.search_index
+
+    def index_entry(self, hash: str) -> None:
+        entries = self.data["entries"]
+        if hash not in entries:
+            self.search_index.remove_entry(hash)
+            return
+        self.search_index.add_entry(
+            hash,
+            entries.get_scheme_hash(hash),
+            self.get_entry_values(hash)[:-2],
+        )
+
+    def index_schemes(self) -> None:
+        for hash, scheme in self.data["schemes"].items():
+            self.search_index.set_scheme(hash, [i[0] for i in scheme[:-2]])
+
+    def update_indexes(self, record: list | tuple) -> None:
+        """
+        Keep the indexes that are already in use up to date with a change
+        """
+        match record[0]:
+            case "set_entry" | "del_entry":
+                self.index_scheme_of_entry(record[1])
+                self.changed_entries.add(record[1])
+                if self.search_index is not None:
+                    self.index_entry(record[1])
+                if self.query_index is not None:
+                    self.query_index_entry(record[1])
+            case "set_scheme" | "del_scheme":
+                self.index_scheme_content(record[1])
+                if self.search_index is not None:
+                    self.search_index.remove_scheme(record[1])
+                    self.index_schemes()
+                if self.query_index is not None:
+                    self.query_index_scheme(record[1])
+
+    # Scheme index
+    # The entries of every scheme (in the order they were added) and the hashes of the
+    # schemes by their columns, both always up to date.
+    def build_scheme_index(self) -> None:
+        self.scheme_entries: dict[str, dict[str, None]] = {}
+        for hash, scheme_hash in self.data["entries"].index.items():
+            self.scheme_entries.setdefault(scheme_hash, {})[hash] = None
+        self.scheme_hashes: dict[tuple, list[str]] = {}
+        for hash, scheme in self.data["schemes"].items():
+            self.scheme_hashes.setdefault(get_scheme_key(scheme[:-2]), []).append(hash)
+
+    def index_scheme_of_entry(self, hash: str) -> None:
+        entries = self.data["entries"]
+        scheme_hash = entries.get_scheme_hash(hash) if hash in entries else None
+        if hash in self.scheme_entries.get(scheme_hash, {}):
+            return  # keeps its position
+        for scheme_entries in self.scheme_entries.values():
+            scheme_entries.pop(hash, None)
+        if scheme_hash is not None:
+            self.scheme_entries.setdefault(scheme_hash, {})[hash] = None
+
+    def index_scheme_content(self, hash: str) -> None:
+        for key, hashes in list(self.scheme_hashes.items()):
+            if hash in hashes:
+                hashes.remove(hash)
+                if hashes == []:
+                    del self.scheme_hashes[key]
+        if hash in self.data["schemes"]:
+            key = get_scheme_key(self.data["schemes"][hash][:-2])
+            self.scheme_hashes.setdefault(key, []).append(hash)
+        elif self.scheme_entries.get(hash) == {}:
+            del self.scheme_entries[hash]
+
+    # Query index
+    # It is kept in memory only and built with the first structured query.
+    def get_query_index(self) -> QueryIndex:
+        if self.query_index is None:
+            self.query_index = QueryIndex()
+            for hash in self.data["schemes"]:
+                self.query_index_scheme(hash)
+            for hash in self.data["entries"]:
+                self.query_index_entry(hash)
+        return self.query_index
+
+    def query_index_entry(self, hash: str) -> None:
+        entries = self.data["entries"]
+        if hash not in entries:
+            self.query_index.remove_entry(hash)
+            return
+        scheme_hash = entries.get_scheme_hash(hash)
+        values = self.get_entry_values(hash)
+        scheme = self.data["schemes"].get(scheme_hash, [])[:-2]
+        self.query_index.add_entry(
+            hash,
+            scheme_hash,
+            # passwords can't be looked up value by value
+            [(i[0], j) for i, j in zip(scheme, values) if i[1] != "Password"],
+            values[-2:],
+        )
+
+    def query_index_scheme(self, hash: str) -> None:
+        if hash not in self.data["schemes"]:
+            self.query_index.remove_scheme(hash)
+            return
+        self.query_index.set_scheme(hash, [i[0] for i in self.data["schemes"][hash]])
+        # the names and constraints of the columns might have changed
+        for entry_hash in self.scheme_entries.get(hash, ()):
+            self.query_index_entry(entry_hash)
+
+    def load_search_index(self) -> SearchIndex | None:
+        """
+        Read the persisted index if it belongs to the snapshot and add the changes since
+        """
+        if not exists(self.search_path):
+            return
+        with open(self.search_path, "rb", buffering=SEGMENT_SIZE) as f:
+            if f.read(len(FILE_MAGIC) + 1) != FILE_MAGIC + FILE_VERSION:
                 return
-            f.write(content)
+            try:
+                data = deserialize(b"".join(self.crypt.decrypt_stream(f, b"search")))
+            except Exception as e:
+                logger.critical(e)
+                return
+        if data["snapshot"] != self.snapshot_id:
+            return
+        self.search_index = SearchIndex(data["hashes"], data["postings"])
+        entries = self.data["entries"]
+        for hash in data["hashes"]:
+            if hash in entries and hash not in self.changed_entries:
+                self.search_index.set_scheme_of_entry(
+                    hash, entries.get_scheme_hash(hash)
+                )
+        self.index_schemes()
+        for hash in self.changed_entries:
+            self.index_entry(hash)
+        return self.search_index
+
+    def write_search_index(self) -> None:
+        """
+        Write the index for the current snapshot, without one the old file is removed
+        """
+        if self.search_index is None:
+            if exists(self.search_path):
+                remove(self.search_path)
+            return
+        data = self.search_index.to_dict()
+        data["snapshot"] = self.snapshot_id
+        with open(self.search_path + ".tmp", "wb", buffering=SEGMENT_SIZE) as f:
+            f.write(FILE_MAGIC + FILE_VERSION)
+            self.crypt.encrypt_stream([serialize(data)], f, b"search")
+            f.flush()
+            fsync(f.fileno())
+        replace(self.search_path + ".tmp", self.search_path)
+
+    # Backups
+    # Every backup is a generation in the backup folder. The first one holds all entries,
+    # the others only the entries that changed since the generation before (records that
+    # are already part of a generation are found by their content hash and not stored again).
+    def get_backup_generations(self) -> list[int]:
+        if not exists(self.backup_folder):
+            return []
+        return sorted(
+            int(splitext(i)[0])
+            for i in listdir(self.backup_folder)
+            if i.endswith(".gen")
+        )
+
+    def get_backup_path(self, generation: int) -> str:
+        return join(self.backup_folder, f"{generation:08d}.gen")
 
+    def read_backup_manifest(self, generation: int) -> dict:
+        """
+        Read only the manifest of a generation and not the records
+        """
+        with open(self.get_backup_path(generation), "rb", buffering=SEGMENT_SIZE) as f:
+            if f.read(len(FILE_MAGIC) + 1) != FILE_MAGIC + FILE_VERSION:
+                logger.critical(f"The backup {generation} has an unsupported format")
+                raise Exception("Unsupported file version")
+            return deserialize(b"".join(self.crypt.decrypt_stream(f, b"backup")))
+
+    def get_backup_state(self, generation: int | None = None) -> tuple[dict, dict]:
+        """
+        Fold the manifests up to a generation and return the last one and all entries
+        in the form `{entry hash: [scheme hash, content hash]}`
+        """
+        manifest, entries = {}, {}
+        for i in self.get_backup_generations():
+            if generation is not None and i > generation:
+                break
+            manifest = self.read_backup_manifest(i)
+            for hash in manifest["deleted"]:
+                entries.pop(hash, None)
+            entries.update(manifest["changed"])
+        return manifest, entries
+
+    def write_backup_generation(
+        self,
+        generation: int,
+        settings: dict,
+        schemes: dict,
+        changed: dict,
+        deleted: list,
+        tokens: dict,
+    ) -> None:
+        manifest = {
+            "generation": generation,
+            "date": str(datetime.now()),
+            "settings": settings,
+            "schemes": schemes,
+            "changed": changed,
+            "deleted": deleted,
+        }
+        path = self.get_backup_path(generation)
+        with open(path + ".tmp", "wb", buffering=SEGMENT_SIZE) as f:
+            f.write(FILE_MAGIC + FILE_VERSION)
+            self.crypt.encrypt_stream([serialize(manifest)], f, b"backup")
+            for content_hash, token in tokens.items():
+                write_frame(f, content_hash.encode() + token)
+            f.flush()
+            fsync(f.fileno())
+        replace(path + ".tmp", path)
+
+    @locked
+    @synchronized
     def write_backup(self) -> None:
-        with open(self.backup_path, "wb") as f:
-            if (
-                content := self.crypt.encrypt(str(self.data).replace("True", "true"))
-            ) is None:
+        """
+        Add a generation with the changes since the last one (nothing is written without changes)
+        """
+        generations = self.get_backup_generations()
+        last_manifest, last_entries = self.get_backup_state()
+        entries = self.data["entries"]
+        current, tokens = {}, {}
+        for hash in entries:
+            if (token := entries.get_token(hash)) is None:
                 return
-            f.write(content)
+            content_hash = sha256(token).hexdigest()
+            current[hash] = [entries.get_scheme_hash(hash), content_hash]
+            if last_entries.get(hash) != current[hash]:
+                tokens[content_hash] = token
+        deleted = [hash for hash in last_entries if hash not in current]
+        if (
+            generations != []
+            and tokens == {}
+            and deleted == []
+            and last_manifest["settings"] == self.data["settings"]
+            and last_manifest["schemes"] == self.data["schemes"]
+        ):
+            return
+        makedirs(self.backup_folder, exist_ok=True)
+        generation = generations[-1] + 1 if generations != [] else 1
+        self.write_backup_generation(
+            generation,
+            self.data["settings"],
+            self.data["schemes"],
+            {
+                hash: current[hash]
+                for hash in current
+                if current[hash] != last_entries.get(hash)
+            },
+            deleted,
+            tokens,
+        )
+        # fold the old generations only every now and then, so not every backup pays for it
+        if len(generations) + 1 >= 2 * BACKUP_GENERATIONS:
+            self.fold_backups(generations[-BACKUP_GENERATIONS + 1])
 
-    def load_backup_data(self) -> None:
+    def fold_backups(self, generation: int) -> None:
         """
-        Load backup data as the dict
+        Make a generation hold all its entries and remove the generations before it
         """
-        with open(self.backup_path, "r") as f:
-            data = self.crypt.decrypt(f.readline())
-            if data is not None:
-                return loads(data.replace("'", '"'))
+        data = self.load_backup_data(generation)
+        entries = data["entries"]
+        changed = {
+            hash: [
+                entries.get_scheme_hash(hash),
+                sha256(entries.tokens[hash]).hexdigest(),
+            ]
+            for hash in entries
+        }
+        self.write_backup_generation(
+            generation,
+            data["settings"],
+            data["schemes"],
+            changed,
+            [],
+            {
+                content_hash: entries.tokens[hash]
+                for hash, (_, content_hash) in changed.items()
+            },
+        )
+        for i in self.get_backup_generations():
+            if i < generation:
+                remove(self.get_backup_path(i))
 
-        logger.critical("Wrong password provided or something else went wrong.")
-        raise Exception("Wrong Password")
+    def copy_backups(self, folder: str, crypt: Cryptographer) -> None:
+        """
+        Write all generations to `folder`, encrypted with `crypt` instead of the key of
+        this session. The content hashes stay as they are, they only link the manifests
+        to the records.
+        """
+        makedirs(folder)
+        for generation in self.get_backup_generations():
+            path = self.get_backup_path(generation)
+            with (
+                open(path, "rb", buffering=SEGMENT_SIZE) as f,
+                open(
+                    join(folder, basename(path)), "wb", buffering=SEGMENT_SIZE
+                ) as new_f,
+            ):
+                if f.read(len(FILE_MAGIC) + 1) != FILE_MAGIC + FILE_VERSION:
+                    logger.critical(
+                        f"The backup {generation} has an unsupported format"
+                    )
+                    raise Exception("Unsupported file version")
+                manifest = deserialize(
+                    b"".join(self.crypt.decrypt_stream(f, b"backup"))
+                )
+                hashes = {
+                    content_hash: hash
+                    for hash, (_, content_hash) in manifest["changed"].items()
+                }
+                new_f.write(FILE_MAGIC + FILE_VERSION)
+                crypt.encrypt_stream([serialize(manifest)], new_f, b"backup")
+                while (frame := read_frame(f)) is not None:
+                    # the values of an entry are bound to its hash
+                    aad = hashes.get(frame[:64].decode(), "").encode()
+                    values = self.crypt.decrypt(frame[64:], aad)
+                    token = None if values is None else crypt.encrypt(values, aad)
+                    if token is None:
+                        logger.critical(
+                            f"Couldn't encrypt the backup {generation} again"
+                        )
+                        raise Exception("Couldn't encrypt the backup again")
+                    write_frame(new_f, frame[:64] + token)
+                new_f.flush()
+                fsync(new_f.fileno())
+
+    def load_backup_data(self, generation: int | None = None) -> dict:
+        """
+        Load backup data (of the last generation by default) as the dict
+        """
+        generations = self.get_backup_generations()
+        if generations == [] and exists(self.backup_path):
+            # the single backup file of older versions
+            return self.read_snapshot(self.backup_path)
+        if generation is None:
+            generation = generations[-1]
+        if generation not in generations:
+            logger.critical(f"There is no backup with the generation {generation}")
+            raise Exception("Unknown backup generation")
+        manifest, state = self.get_backup_state(generation)
+        needed = {content_hash: hash for hash, (_, content_hash) in state.items()}
+        tokens = {}
+        for i in generations:
+            if i > generation:
+                break
+            with open(self.get_backup_path(i), "rb", buffering=SEGMENT_SIZE) as f:
+                f.read(len(FILE_MAGIC) + 1)
+                for _ in self.crypt.decrypt_stream(f, b"backup"):
+                    pass
+                while (frame := read_frame(f)) is not None:
+                    content_hash = frame[:64].decode(errors="replace")
+                    if content_hash not in needed:
+                        continue
+                    hash = needed[content_hash]
+                    if self.crypt.decrypt(frame[64:], hash.encode()) is None:
+                        logger.critical(f"The backup of the entry {hash} is damaged")
+                        continue
+                    tokens[hash] = frame[64:]
+        index = {hash: scheme_hash for hash, (scheme_hash, _) in state.items()}
+        self.leave_out_unreadable(index, tokens)
+        return {
+            "settings": manifest["settings"],
+            "schemes": manifest["schemes"],
+            "entries": EntryStore(self.crypt, index, tokens),
+        }
 
-    def overwrite_main_data_with_backup(self) -> None:
-        self.load_backup_data()
-        self.update_data()
+    @locked
+    @synchronized
+    def overwrite_main_data_with_backup(self, generation: int | None = None) -> None:
+        self.take_over_changes()  # only to know the generation on the disk
+        self.data = self.load_backup_data(generation)
+        self.search_index, self.query_index = None, None
+        self.build_scheme_index()
+        if exists(self.search_path):
+            remove(self.search_path)
+        self.write_new_snapshot()
 
 
 class DataManager(FileManager):
@@ -143,19 +1212,108 @@ class DataManager(FileManager):
         super().__init__(path_to_file, key)
         self.hidden_stats = [["Changedate", "Hidden"], ["Creationdate", "Hidden"]]
         self.current_data: list = []
+        # the layout of the displayed entries, see update_layout
+        self.entry_lines: list[int] = []  # ordinal -> line number
+        self.entry_hashes: list[str] = []  # ordinal -> entry hash
+        self.ordinal_of_line: dict[int, int] = {}
+        self.ordinal_of_hash: dict[str, int] = {}
         self.order = []
+        self.salt: bytes | None = None
+        self.kdf_settings: dict = DEFAULT_KDF_SETTINGS
+        self.unlock_window = 0  # seconds a correct password keeps the data unlocked
+        self.auto_lock = 0  # seconds without input until the screen locks (0 never)
+        self.unlocked_until = 0.0
+        # the base64 decoded values of the entries (entry hash -> values)
+        self.decoded_values: dict[str, list[str]] = {}
+        # what was rendered for the tables: the cells of every entry (entry hash ->
+        # cells) and the table of every scheme (scheme hash -> (entry hashes, table))
+        self.rendered_rows: dict[str, list[str]] = {}
+        self.rendered_tables: dict[str, tuple[tuple, str]] = {}
+        self.rendered_dates_hidden: list | None = None  # the settings they depend on
 
     def is_master_password(self, pw: str) -> bool:
-        folder_path_cross_platform = split(self.path_to_file)[0]
-        with open(join(folder_path_cross_platform, ".salt"), "rb") as f:
-            kdf = get_hashing_obj(f.readline())
+        """
+        Derive the key of the password and compare it to the key of this session
+        """
+        if self.salt is None:
+            folder_path_cross_platform = split(self.path_to_file)[0]
+            self.salt = read_salt(folder_path_cross_platform)
+            self.kdf_settings = read_kdf_settings(folder_path_cross_platform)
         try:
-            key = convert_pw_to_key(kdf, pw)
-            DataManager(self.path_to_file, key)
-            return True
+            key = convert_pw_to_key(get_hashing_obj(self.salt, self.kdf_settings), pw)
         except Exception as e:
             logger.critical(e)
             return False
+        if not compare_digest(key, self.key):
+            return False
+        self.unlocked_until = monotonic() + self.unlock_window
+        return True
+
+    def is_unlocked(self) -> bool:
+        """
+        True if the master password was provided within the unlock window
+        """
+        return monotonic() < self.unlocked_until
+
+    def lock(self) -> None:
+        self.unlocked_until = 0.0
+
+    @locked
+    @synchronized
+    def rekey(self, pw: str, settings: dict) -> None:
+        """
+        Encrypt all data (and the backups) with a key derived from a new salt and the
+        given key derivation settings
+        """
+        folder_path_cross_platform = split(self.path_to_file)[0]
+        salt = urandom(16)
+        key = convert_pw_to_key(get_hashing_obj(salt, settings), pw)
+        self.take_over_changes()
+        entries = self.data["entries"]
+        for hash in entries:
+            entries[hash]  # decrypt every entry with the old key
+        self.get_search_index()
+        crypt = Cryptographer(key)
+
+        # write all new files first, a crash before REKEY_COMMIT keeps the old ones
+        # and one after it is finished with the next login (see finish_rekey)
+        if exists(self.backup_folder + ".rekey"):
+            rmtree(self.backup_folder + ".rekey")  # of a rekey that failed before
+        self.copy_backups(self.backup_folder + ".rekey", crypt)
+        self.crypt = entries.crypt = crypt
+        entries.tokens = {}
+        self.key, self.salt, self.kdf_settings = key, salt, settings
+        self.snapshot_id = self.write_snapshot(
+            self.path_to_file + ".rekey", self.generation + 1
+        )
+        self.generation += 1
+        for name, content in ((".salt", salt), (".kdf", dumps(settings).encode())):
+            with open(join(folder_path_cross_platform, name + ".rekey"), "wb") as f:
+                f.write(content)
+                f.flush()
+                fsync(f.fileno())
+        with open(join(folder_path_cross_platform, REKEY_COMMIT), "wb") as f:
+            fsync(f.fileno())
+        replace_with_rekey_files(folder_path_cross_platform)
+        self.key_header = read_key_header(folder_path_cross_platform)
+        self.remove_journal()
+        self.journal_offset, self.journal_size = 0, 0
+        self.pending = []
+        self.changed_entries = set()
+        self.write_search_index()
+        self.write_backup()
+        logger.info(f"Encrypted the data with new {settings['algorithm']} settings")
+
+    def overwrite_main_data_with_backup(self, generation: int | None = None) -> None:
+        self.decoded_values = {}
+        self.rendered_rows, self.rendered_tables = {}, {}
+        super().overwrite_main_data_with_backup(generation)
+
+    def take_over_changes(self) -> int:
+        if (num_records := super().take_over_changes()) != 0:
+            self.decoded_values = {}
+            self.rendered_rows, self.rendered_tables = {}, {}
+        return num_records
 
     @staticmethod
     def gen_hash() -> str:
@@ -165,20 +1323,32 @@ class DataManager(FileManager):
         """
         For display purposes
         """
-        sorted_data = dict(
-            sorted(data.items(), key=lambda item: item[1]["scheme_hash"])
-        )
-        first_time = True
+        entries = self.data["entries"]
+        if data is entries:
+            groups = self.scheme_entries
+        else:
+            groups = {}
+            for hash in data:
+                groups.setdefault(entries.get_scheme_hash(hash), {})[hash] = None
         scheme_hashes, grouped_data = [], []
-        for hash, values in sorted_data.items():
-            if first_time or values["scheme_hash"] != scheme_hashes[-1]:
-                first_time = False
-                scheme_hashes.append(values["scheme_hash"])
-                grouped_data.append([[hash, values["values"]]])
-            else:
-                grouped_data[-1].append([hash, values["values"]])
+        for scheme_hash in sorted(groups):
+            if groups[scheme_hash] == {} or scheme_hash not in self.data["schemes"]:
+                continue
+            # entries of hidden schemes are not displayed, so they stay encrypted
+            is_hidden = scheme_hash in self.data["settings"]["hidden_schemes"]
+            scheme_hashes.append(scheme_hash)
+            grouped_data.append(
+                [
+                    [hash, None if is_hidden else entries[hash]["values"]]
+                    for hash in groups[scheme_hash]
+                ]
+            )
         # Order logic here
         for operation in self.order:
+            if operation[0] not in scheme_hashes:
+                continue
+            if operation[0] in self.data["settings"]["hidden_schemes"]:
+                continue
             idx = scheme_hashes.index(operation[0])
             grouped_data[idx].sort(
                 key=lambda x: x[1][operation[1]], reverse=operation[2]
@@ -192,19 +1362,33 @@ class DataManager(FileManager):
     def get_hidden_dates_settings(self) -> list:
         return self.data["settings"]["dates_hidden"]
 
-    def get_entries_of_scheme(self, scheme_hash: str) -> dict:
-        entries = {}
-        for key, entry in self.data["entries"].items():
-            if entry["scheme_hash"] == scheme_hash:
-                entries.update({key: entry})
-        return entries
+    def get_entries_by_query(self, query: str) -> Iterator[str]:
+        """
+        The hashes of the entries matching a query like `scheme:"Email used" app:git*
+        changed>2025-01-01` (see Query.py), raises a ValueError for an invalid one
+        """
+        return self.get_query_index().query(query)
 
     def get_entry_values(self, hash: str) -> list[str]:
         if hash not in self.data["entries"].keys():
             return []
-        return [
-            b64decode(i.encode()).decode() for i in self.data["entries"][hash]["values"]
-        ]
+        if hash not in self.decoded_values:
+            self.decoded_values[hash] = [
+                b64decode(i.encode()).decode()
+                for i in self.data["entries"][hash]["values"]
+            ]
+        return list(self.decoded_values[hash])
+
+    def iter_entry_values(self, scheme_hash: str) -> Iterator[tuple[str, list[str]]]:
+        """
+        The hashes and values of the entries of a scheme, decrypted and decoded one
+        after another without caching them (for exports of any size)
+        """
+        entries = self.data["entries"]
+        for hash in self.scheme_entries.get(scheme_hash, ()):
+            yield hash, [
+                b64decode(i.encode()).decode() for i in entries.read_values(hash)
+            ]
 
     def get_values_beautified(self, hash: str) -> list[str] | None:
         if hash not in self.data["entries"].keys():
@@ -215,46 +1399,52 @@ class DataManager(FileManager):
 
         table = PrettyTable()
         table.field_names = (i[0] for i in self.data["schemes"][scheme_hash])
-        table.add_row(
-            [
-                b64decode(i.encode()).decode()
-                for i in self.data["entries"][hash]["values"]
-            ]
-        )
+        table.add_row(self.get_entry_values(hash))
 
         return table.__str__().splitlines()
 
-    def get_entries_beautified(self, hashes: list) -> list:
-        data = {
-            key: values for key, values in self.data["entries"].items() if key in hashes
-        }
-        output = ""
-        scheme_hashes, entries = self.group_data_by_schemes(data)
-        self.current_data = entries
-        for i, scheme in enumerate(scheme_hashes):
-            if scheme in self.data["settings"]["hidden_schemes"]:
-                continue
-            table = PrettyTable()
-            # hide or unhide the date stuff
-            table.field_names = self.apply_settings_to_hidden_dates(
-                self.data["schemes"][scheme], True
+    def get_row_beautified(self, hash: str, scheme_hash: str, values: list) -> list:
+        """
+        The cells of an entry as they are displayed (rendered once until it changes)
+        """
+        if hash not in self.rendered_rows:
+            # prepare data based on constraints
+            modified_entry = self.apply_constraints_to_data(
+                list(zip(values, (i[1] for i in self.data["schemes"][scheme_hash])))
             )
+            self.rendered_rows[hash] = self.apply_settings_to_hidden_dates(
+                modified_entry
+            )
+        return self.rendered_rows[hash]
 
-            for entry in entries[i]:
-                # prepare data based on constraints
-                modified_entry = self.apply_constraints_to_data(
-                    list(zip(entry[1], (i[1] for i in self.data["schemes"][scheme])))
-                )
-                table.add_row(self.apply_settings_to_hidden_dates(modified_entry))
-            output += f"{table.__str__()}\n\n"
-        return (
-            output.splitlines()
-            if output != ""
-            else ["You have no entries to display yet. Add one with [A]."]
+    def get_table_beautified(self, scheme_hash: str, entries: list) -> str:
+        """
+        The table of the `[hash, values]` entries of a scheme, it is only rendered again
+        when other entries are displayed or one of them changed
+        """
+        hashes = tuple(i[0] for i in entries)
+        cached = self.rendered_tables.get(scheme_hash)
+        if cached is not None and cached[0] == hashes:
+            return cached[1]
+        # hide or unhide the date stuff
+        field_names = self.apply_settings_to_hidden_dates(
+            self.data["schemes"][scheme_hash], True
+        )
+        rows = [
+            self.get_row_beautified(hash, scheme_hash, values)
+            for hash, values in entries
+        ]
+        self.rendered_tables[scheme_hash] = hashes, "\n".join(
+            format_table(field_names, rows)
         )
+        return self.rendered_tables[scheme_hash][1]
 
     def get_entries_anonymised_with_hash(self, hashes: list) -> list[str]:
-        entries = [i for i in self.data["entries"].items() if i[0] in hashes]
+        entries = [
+            (key, self.data["entries"][key])
+            for key in hashes
+            if key in self.data["entries"]
+        ]
         options = []
         for entry in entries:
             options.append(
@@ -265,10 +1455,7 @@ class DataManager(FileManager):
                         for i in self.apply_constraints_to_data(
                             list(
                                 zip(
-                                    [
-                                        b64decode(i.encode()).decode()
-                                        for i in entry[1]["values"]
-                                    ],
+                                    self.get_entry_values(entry[0]),
                                     (
                                         i[1]
                                         for i in self.data["schemes"][
@@ -284,15 +1471,23 @@ class DataManager(FileManager):
         return options
 
     def get_scheme_hash_by_scheme(self, p_scheme: list) -> str | None:
+        if (hashes := self.scheme_hashes.get(get_scheme_key(p_scheme))) is not None:
+            return hashes[0]
+        logger.critical("Couldn't find a the provided scheme")
+
+    def get_scheme_hash_by_columns(self, columns: list[str]) -> str | None:
+        """
+        The scheme with these column names (in this order, ignoring the case)
+        """
+        columns = [i.lower() for i in columns]
         for hash, scheme in self.data["schemes"].items():
-            if scheme[:-2] == p_scheme:
+            if [i[0].lower() for i in scheme[:-2]] == columns:
                 return hash
-        logger.critical("Couldn't find a the provided scheme")
 
     def get_scheme_hash_by_entry_hash(self, entry_hash: str) -> str | None:
         if entry_hash not in self.data["entries"].keys():
             return
-        return self.data["entries"][entry_hash]["scheme_hash"]
+        return self.data["entries"].get_scheme_hash(entry_hash)
 
     def get_schemes(self) -> list:
         return [i[:-2] for i in self.data["schemes"].values()]
@@ -314,119 +1509,146 @@ class DataManager(FileManager):
     def get_scheme_head(self, scheme_hash: str) -> str | None:
         if scheme_hash not in self.data["schemes"].keys():
             return
-        table = PrettyTable()
-        table.field_names = [i[0] for i in self.data["schemes"][scheme_hash]]
-        return table.__str__().splitlines()[1]
-
-    def get_longest_entry_beautified(self) -> tuple:
-        data = self.beautify_output(self.get_all_entries()).splitlines()
-        y, x = len(data) - 1, max(len(i) for i in data) + 2
-        return y, x
+        field_names = [i[0] for i in self.data["schemes"][scheme_hash]]
+        return format_row(field_names, get_column_widths(field_names, []))
 
     def get_idx_of_entries(self) -> list[int]:
-        if self.current_data is None:
-            return []
-        entries = [
-            scheme
-            for scheme in self.current_data
-            if self.data["entries"][scheme[0][0]]["scheme_hash"]
-            not in self.data["settings"]["hidden_schemes"]
-        ]
-        HEADER_SIZE, SPACE_BETWEEN_TABLES, SPACE_BETWEEN_ENTRIES = 4, 2, 1
-        idx = []
-        counter = -1
-        for i in range(len(entries)):
-            if counter != -1:
-                counter += SPACE_BETWEEN_TABLES
-            counter += HEADER_SIZE
-            idx.append(counter)
-            for _ in range(len(entries[i]) - 1):
-                counter += SPACE_BETWEEN_ENTRIES
-                idx.append(counter)
-        return idx
+        return self.entry_lines
+
+    def get_entry_ordinal(self, line: int) -> int:
+        """
+        The position of the entry on a line among the displayed ones, raises a ValueError
+        if there is no entry on it
+        """
+        if line not in self.ordinal_of_line:
+            raise ValueError(f"There is no entry on line {line}")
+        return self.ordinal_of_line[line]
 
     def get_entry_hash_by_pointer_idx(self, pointer_idx: list) -> str:
-        try:
-            idx = pointer_idx[1].index(pointer_idx[0])
-            joined_list = [
-                entry[0]
-                for scheme in self.current_data
-                for entry in scheme
-                if self.data["entries"][entry[0]]["scheme_hash"]
-                not in self.data["settings"]["hidden_schemes"]
-            ]
-            return joined_list[idx]
-        except ValueError:
+        if (idx := self.ordinal_of_line.get(pointer_idx[0])) is None:
             return self.current_data[0][0][0]
+        return self.entry_hashes[idx]
 
     def get_pointer_idx_by_hash(self, entry_hash: str) -> int | None:
-        joined_list = [
-            entry[0]
-            for scheme in self.current_data
-            for entry in scheme
-            if self.data["entries"][entry[0]]["scheme_hash"]
-            not in self.data["settings"]["hidden_schemes"]
-        ]
-        try:
-            idx = joined_list.index(entry_hash)
-            return self.get_idx_of_entries()[idx]
-        except ValueError as e:
-            logger.critical(e)
+        if (idx := self.ordinal_of_hash.get(entry_hash)) is None:
             return
+        return self.entry_lines[idx]
 
     # Setter
+    @synchronized
     def set_hidden_dates_settings(self, new_settings: list[bool]) -> None:
         self.data["settings"]["dates_hidden"] = new_settings
+        self.log_change("set_settings", self.data["settings"])
 
+    @synchronized
     def set_hidden_schemes(self, hidden_schemes: list) -> None:
         self.data["settings"]["hidden_schemes"] = hidden_schemes
+        self.log_change("set_settings", self.data["settings"])
 
     # Add data
-    def add_entry(self, scheme_hash: str, entry: list[str]) -> None:
+    @synchronized
+    def add_entry(
+        self, scheme_hash: str, entry: list[str], dates: list[str] | None = None
+    ) -> str:
+        """
+        Add an entry, the dates (change and creation date) are now if none are given
+        """
         data = {}
         now = str(datetime.now())
-        entry.extend([now, now])
+        entry.extend([now, now] if dates is None else dates)
         data["scheme_hash"] = scheme_hash
         data["values"] = [b64encode(i.encode()).decode() for i in entry]
-        self.data["entries"].update({self.gen_hash(): data})
-
-    def add_scheme(self, scheme: list) -> None:
+        hash = self.gen_hash()
+        self.data["entries"].update({hash: data})
+        self.decoded_values.pop(hash, None)
+        self.log_change("set_entry", hash, data)
+        return hash
+
+    @synchronized
+    def add_scheme(self, scheme: list) -> str:
         scheme.extend(self.hidden_stats)
-        self.data["schemes"].update({self.gen_hash(): scheme})
+        hash = self.gen_hash()
+        self.data["schemes"].update({hash: scheme})
+        self.log_change("set_scheme", hash, scheme)
+        return hash
 
     # Update methods
+    @synchronized
     def update_entry(self, entry_hash: str, new_data: list[str]) -> None:
         if entry_hash not in self.data["entries"].keys():
             return
-        new_data.extend(
-            [str(datetime.now()), self.data["entries"][entry_hash]["values"][-1]]
-        )
-        self.data["entries"][entry_hash]["values"] = [
-            b64encode(i.encode()) for i in new_data
-        ]
+        entry = self.data["entries"][entry_hash]
+        new_data.extend([str(datetime.now()), self.get_entry_values(entry_hash)[-1]])
+        data = {
+            "scheme_hash": entry["scheme_hash"],
+            "values": [b64encode(i.encode()).decode() for i in new_data],
+        }
+        self.data["entries"][entry_hash] = data
+        self.decoded_values.pop(entry_hash, None)
+        self.rendered_rows.pop(entry_hash, None)
+        self.rendered_tables.pop(entry["scheme_hash"], None)
+        self.log_change("set_entry", entry_hash, data)
 
+    @synchronized
     def update_scheme(self, scheme_hash: str, new_data: list) -> None:
         if scheme_hash not in self.data["schemes"].keys():
             return
         new_data.extend(self.hidden_stats)
         self.data["schemes"][scheme_hash] = new_data
+        self.rendered_tables.pop(scheme_hash, None)
+        for hash in self.scheme_entries.get(scheme_hash, ()):
+            self.rendered_rows.pop(hash, None)
+        self.log_change("set_scheme", scheme_hash, new_data)
 
     # Delete methods
+    @synchronized
     def delete_entry(self, entry_hash: str) -> None:
         if entry_hash not in self.data["entries"].keys():
             return
         del self.data["entries"][entry_hash]
+        self.decoded_values.pop(entry_hash, None)
+        self.rendered_rows.pop(entry_hash, None)
+        self.log_change("del_entry", entry_hash)
 
+    @locked
+    @synchronized
     def delete_scheme(self, scheme_hash: str) -> None:
-        entries_with_scheme = self.get_entries_of_scheme(scheme_hash)
-        for hash in entries_with_scheme.keys():
+        # the entries other sessions added to the scheme are deleted as well
+        self.take_over_changes()
+        for hash in list(self.scheme_entries.get(scheme_hash, ())):
             self.delete_entry(hash)
 
         if scheme_hash not in self.data["schemes"].keys():
             return
         del self.data["schemes"][scheme_hash]
+        self.rendered_tables.pop(scheme_hash, None)
+        self.log_change("del_scheme", scheme_hash)
 
     # Output methods
+    def update_layout(self) -> None:
+        """
+        Map the displayed entries to the lines they are on and the other way around
+        """
+        HEADER_SIZE, SPACE_BETWEEN_TABLES, SPACE_BETWEEN_ENTRIES = 4, 2, 1
+        self.entry_lines, self.entry_hashes = [], []
+        counter = -1
+        for scheme in self.current_data:
+            if (
+                self.data["entries"].get_scheme_hash(scheme[0][0])
+                in self.data["settings"]["hidden_schemes"]
+            ):
+                continue
+            if counter != -1:
+                counter += SPACE_BETWEEN_TABLES
+            counter += HEADER_SIZE
+            for num, entry in enumerate(scheme):
+                if num != 0:
+                    counter += SPACE_BETWEEN_ENTRIES
+                self.entry_lines.append(counter)
+                self.entry_hashes.append(entry[0])
+        self.ordinal_of_line = {line: i for i, line in enumerate(self.entry_lines)}
+        self.ordinal_of_hash = {hash: i for i, hash in enumerate(self.entry_hashes)}
+
     def apply_settings_to_hidden_dates(self, data: list, is_table_header=False) -> list:
         if is_table_header:
             idx = sorted(
@@ -477,25 +1699,17 @@ class DataManager(FileManager):
         """
         if multiple schemes display them below each other
         """
-        output = ""
+        if self.rendered_dates_hidden != self.data["settings"]["dates_hidden"]:
+            self.rendered_rows, self.rendered_tables = {}, {}
+            self.rendered_dates_hidden = list(self.data["settings"]["dates_hidden"])
         scheme_hashes, entries = self.group_data_by_schemes(data)
         self.current_data = entries
-        for i, scheme in enumerate(scheme_hashes):
-            if scheme in self.data["settings"]["hidden_schemes"]:
-                continue
-            table = PrettyTable()
-            # hide or unhide the date stuff
-            table.field_names = self.apply_settings_to_hidden_dates(
-                self.data["schemes"][scheme], True
-            )
-
-            for entry in entries[i]:
-                # prepare data based on constraints
-                modified_entry = self.apply_constraints_to_data(
-                    list(zip(entry[1], (i[1] for i in self.data["schemes"][scheme])))
-                )
-                table.add_row(self.apply_settings_to_hidden_dates(modified_entry))
-            output += f"{table.__str__()}\n\n"
+        self.update_layout()
+        output = "".join(
+            f"{self.get_table_beautified(scheme, entries[i])}\n\n"
+            for i, scheme in enumerate(scheme_hashes)
+            if scheme not in self.data["settings"]["hidden_schemes"]
+        )
         return (
             output
             if output != ""
@@ -537,15 +1751,183 @@ def evaluate_password(password: str) -> str:
         return "HACKED"
 
 
-def get_hashing_obj(salt: bytes) -> PBKDF2HMAC:
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=480000,
-    )
-    return kdf
+# SOME FUNCTIONS REGARDING THE KEY DERIVATION
+class Argon2id:
+    """
+    Same interface as the key derivation functions of `cryptography`
+    """
+
+    def __init__(
+        self, salt: bytes, time_cost: int, memory_cost: int, parallelism: int
+    ) -> None:
+        if hash_secret_raw is None:
+            raise Exception("Argon2id needs the `argon2-cffi` package to be installed")
+        self.salt = salt
+        self.time_cost = time_cost
+        self.memory_cost = memory_cost
+        self.parallelism = parallelism
+
+    def derive(self, key_material: bytes) -> bytes:
+        return hash_secret_raw(
+            key_material,
+            self.salt,
+            self.time_cost,
+            self.memory_cost,
+            self.parallelism,
+            32,
+            Type.ID,
+        )
+
+
+def replace_with_rekey_files(folder: str) -> None:
+    """
+    Move the files of a rekey (`*.rekey`) over the old ones, it can be repeated when it
+    was interrupted
+    """
+    for name in listdir(folder):
+        if not name.endswith(".rekey"):
+            continue
+        path = join(folder, name[: -len(".rekey")])
+        if isdir(path + ".rekey") and exists(path):
+            rmtree(path)  # the backup folder
+        replace(path + ".rekey", path)
+    remove(join(folder, REKEY_COMMIT))
+
+
+def finish_rekey(path_to_file: str) -> None:
+    """
+    Complete a rekey that was interrupted while its files replaced the old ones, or
+    remove its files when it didn't get that far. Has to run before the salt is read.
+    """
+    folder = split(path_to_file)[0]
+    if not any(i.endswith(".rekey") or i == REKEY_COMMIT for i in listdir(folder)):
+        return
+    with open(splitext(path_to_file)[0] + ".lock", "ab") as lock_file:
+        if flock is not None:
+            flock(lock_file.fileno(), LOCK_EX)  # another session might still rekey
+        if exists(join(folder, REKEY_COMMIT)):
+            replace_with_rekey_files(folder)
+            logger.info("Finished an interrupted rekey")
+            return
+        for name in listdir(folder):
+            if name.endswith(".rekey"):
+                logger.critical(f"Removed {name}, the rekey didn't finish")
+                if isdir(join(folder, name)):
+                    rmtree(join(folder, name))
+                else:
+                    remove(join(folder, name))
+
+
+def read_key_header(folder: str) -> bytes:
+    """
+    The salt and the key derivation header as they are stored, they change with a rekey
+    """
+    header = read_salt(folder)
+    if exists(join(folder, ".kdf")):
+        with open(join(folder, ".kdf"), "rb") as f:
+            header += f.read()
+    return header
 
 
-def convert_pw_to_key(kdf: PBKDF2HMAC, pw: str) -> bytes:
+def read_salt(folder: str) -> bytes:
+    with open(join(folder, ".salt"), "rb") as f:
+        return f.read()
+
+
+def read_kdf_settings(folder: str) -> dict:
+    """
+    Read the key derivation header of a user (users without one use the old default)
+    """
+    path = join(folder, ".kdf")
+    if not exists(path):
+        return DEFAULT_KDF_SETTINGS
+    with open(path, "r") as f:
+        settings = loads(f.read())
+    if settings.get("version") != KDF_HEADER_VERSION:
+        logger.critical(f"Unsupported key derivation header {settings.get('version')}")
+        raise Exception("Unsupported key derivation header")
+    return settings
+
+
+def write_kdf_settings(folder: str, settings: dict) -> None:
+    with open(join(folder, ".kdf"), "w") as f:
+        f.write(dumps(settings))
+
+
+def get_hashing_obj(salt: bytes, settings: dict | None = None):
+    settings = DEFAULT_KDF_SETTINGS if settings is None else settings
+    params = settings["params"]
+    match settings["algorithm"]:
+        case "pbkdf2-sha256":
+            return PBKDF2HMAC(
+                algorithm=hashes.SHA256(),
+                length=32,
+                salt=salt,
+                iterations=params["iterations"],
+            )
+        case "scrypt":
+            return Scrypt(
+                salt=salt, length=32, n=params["n"], r=params["r"], p=params["p"]
+            )
+        case "argon2id":
+            return Argon2id(
+                salt, params["time_cost"], params["memory_cost"], params["parallelism"]
+            )
+    logger.critical(f"Unknown key derivation function {settings['algorithm']}")
+    raise Exception("Unknown key derivation function")
+
+
+def convert_pw_to_key(kdf, pw: str) -> bytes:
     return urlsafe_b64encode(kdf.derive(pw.encode()))
+
+
+def time_key_derivation(settings: dict, runs=3) -> float:
+    """
+    Time a key derivation with the given settings in milliseconds (best of `runs`)
+    """
+    durations = []
+    for _ in range(runs):
+        kdf = get_hashing_obj(urandom(16), settings)
+        start = perf_counter()
+        kdf.derive(b"calibration")
+        durations.append((perf_counter() - start) * 1000)
+    return min(durations)
+
+
+def calibrate_kdf(algorithm: str, target_ms: int) -> dict:
+    """
+    Find the settings for the key derivation function that take about `target_ms` on this host
+    """
+    settings = {"version": KDF_HEADER_VERSION, "algorithm": algorithm}
+    match algorithm:
+        case "pbkdf2-sha256":
+            # the duration grows linearly with the iterations
+            settings["params"] = {"iterations": 100000}
+            duration = time_key_derivation(settings)
+            iterations = int(100000 * target_ms / duration) // 1000 * 1000
+            settings["params"] = {
+                "iterations": max(iterations, MIN_KDF_PARAMS["iterations"])
+            }
+        case "scrypt":
+            settings["params"] = {"n": MIN_KDF_PARAMS["n"], "r": 8, "p": 1}
+            while (
+                time_key_derivation(settings) * 2 <= target_ms
+                and settings["params"]["n"] < MAX_SCRYPT_N
+            ):
+                settings["params"]["n"] *= 2
+        case "argon2id":
+            settings["params"] = {
+                "time_cost": MIN_KDF_PARAMS["time_cost"],
+                "memory_cost": MIN_KDF_PARAMS["memory_cost"],
+                "parallelism": min(cpu_count() or 1, 4),
+            }
+            # the duration grows (roughly) linearly with the passes over the memory
+            while (duration := time_key_derivation(settings)) < target_ms * 0.9:
+                settings["params"]["time_cost"] = max(
+                    int(settings["params"]["time_cost"] * target_ms / duration),
+                    settings["params"]["time_cost"] + 1,
+                )
+        case _:
+            logger.critical(f"Unknown key derivation function {algorithm}")
+            raise Exception("Unknown key derivation function")
+    return settings
@@ -0,0 +1,104 @@
+from collections.abc import Callable, Iterator
+from csv import writer
+from json import dumps
+from os import urandom
+from typing import BinaryIO, TextIO
+
+from assets import EXPORT_BATCH_SIZE
+from Data_Manager import (
+    Cryptographer,
+    DataManager,
+    convert_pw_to_key,
+    get_hashing_obj,
+    write_frame,
+)
+
+ARCHIVE_MAGIC = b"ONIEXPORT"
+ARCHIVE_VERSION = b"\x01"
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".oniguard": "archive"}
+
+
+def iter_rows(data_manager: DataManager) -> Iterator[tuple[list[str], list[str]]]:
+    """
+    The entries grouped by scheme as `(columns, values)`, the change and creation date
+    are the last two columns
+    """
+    dates = [i[0] for i in data_manager.hidden_stats]
+    for scheme_hash, scheme in data_manager.get_schemes_with_hash():
+        columns = [i[0] for i in scheme] + dates
+        for _, values in data_manager.iter_entry_values(scheme_hash):
+            yield columns, values
+
+
+def report_progress(
+    rows: Iterator[tuple[list[str], list[str]]], progress: Callable[[int], None]
+) -> Iterator[tuple[list[str], list[str]]]:
+    for count, row in enumerate(rows, 1):
+        yield row
+        if count % EXPORT_BATCH_SIZE == 0:
+            progress(count)
+
+
+def to_line(columns: list[str], values: list[str]) -> str:
+    return dumps(dict(zip(columns, values)), ensure_ascii=False) + "\n"
+
+
+def write_csv(rows: Iterator[tuple[list[str], list[str]]], f: TextIO) -> int:
+    """
+    One section per scheme (its header row and its entries), the sections are separated
+    by an empty row
+    """
+    csv, columns, count = writer(f), None, 0
+    for row_columns, values in rows:
+        if row_columns != columns:
+            if columns is not None:
+                csv.writerow([])
+            csv.writerow(row_columns)
+            columns = row_columns
+        csv.writerow(values)
+        count += 1
+    return count
+
+
+def write_json_lines(rows: Iterator[tuple[list[str], list[str]]], f: TextIO) -> int:
+    count = 0
+    for columns, values in rows:
+        f.write(to_line(columns, values))
+        count += 1
+    return count
+
+
+def get_archive_header(salt: bytes, kdf_settings: bytes) -> bytes:
+    """
+    Everything in front of the encrypted stream, it is authenticated along with it
+    """
+    return ARCHIVE_MAGIC + ARCHIVE_VERSION + salt + kdf_settings
+
+
+def write_archive(
+    rows: Iterator[tuple[list[str], list[str]]],
+    f: BinaryIO,
+    password: str,
+    kdf_settings: dict,
+) -> int:
+    """
+    The entries as JSON lines, encrypted with a key derived from the password (and a
+    new salt) instead of the key of the user
+    """
+    salt, settings = urandom(16), dumps(kdf_settings).encode()
+    f.write(ARCHIVE_MAGIC + ARCHIVE_VERSION)
+    write_frame(f, salt)
+    write_frame(f, settings)
+    crypt = Cryptographer(
+        convert_pw_to_key(get_hashing_obj(salt, kdf_settings), password)
+    )
+    count = 0
+
+    def lines() -> Iterator[bytes]:
+        nonlocal count
+        for columns, values in rows:
+            count += 1
+            yield to_line(columns, values).encode()
+
+    crypt.encrypt_stream(lines(), f, get_archive_header(salt, settings))
+    return count
@@ -1,20 +1,291 @@
+from collections import Counter
+from collections.abc import Callable, Iterable
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heappush, heapreplace, nlargest
+from os import cpu_count
+
 from thefuzz import process
 
+from assets import PARALLEL_SEARCH_THRESHOLD, SEARCH_SHORTLIST_SIZE, SEARCH_WORKERS
+
+# the process pool of parallel searches, it is started with the first one
+pool: ProcessPoolExecutor | None = None
+pool_size = 0
+
+
+def get_top_matches(query: str, items: Iterable, top_n: int, min_score=0) -> list:
+    """
+    Score the `(ordinal, key, choices)` items and return the heap of the `top_n` best
+    matches as `(score, -ordinal, key, match)`
+    """
+    # the best matches so far with the worst (and on a tie the latest) one on top
+    heap = []
+    if top_n <= 0:
+        return heap
+    for num, key, choices in items:
+        # once the heap is full only a better score than its worst match counts,
+        # the scorer stops early for all the others
+        score_cutoff = heap[0][0] + 1 if len(heap) == top_n else min_score
+        if score_cutoff > 100:
+            break  # nothing beats a perfect match
+        best_match = process.extractOne(query, choices, score_cutoff=score_cutoff)
+        if best_match is None:
+            continue
+        item = (best_match[1], -num, key, best_match[0])
+        if len(heap) < top_n:
+            heappush(heap, item)
+        else:
+            heapreplace(heap, item)
+    return heap
+
+
+def get_trigrams(text: str) -> set[str]:
+    text = f" {text.lower()} "
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """
+    Trigram index over the values of the entries and the column names of the schemes.
+    A query is narrowed down to a shortlist with it, so only the shortlist is scored.
+    """
+
+    def __init__(
+        self, hashes: list | None = None, postings: dict | None = None
+    ) -> None:
+        # entries are referenced by their ordinal, removed entries leave a None behind
+        self.hashes: list[str | None] = hashes if hashes is not None else []
+        self.ordinals: dict[str, int] = {
+            hash: num for num, hash in enumerate(self.hashes)
+        }
+        self.postings: dict[str, set[int]] = {
+            trigram: set(ordinals) for trigram, ordinals in (postings or {}).items()
+        }
+        self.scheme_of: dict[str, str] = {}
+        self.entries_of_scheme: dict[str, set[str]] = {}
+        self.columns: dict[str, list[str]] = {}
+        self.column_postings: dict[str, set[str]] = {}  # trigram -> scheme hashes
+
+    def add_entry(self, hash: str, scheme_hash: str, values: list[str]) -> None:
+        self.remove_entry(hash)
+        self.ordinals[hash] = len(self.hashes)
+        self.hashes.append(hash)
+        for trigram in set().union(*(get_trigrams(i) for i in values)):
+            self.postings.setdefault(trigram, set()).add(self.ordinals[hash])
+        self.set_scheme_of_entry(hash, scheme_hash)
+
+    def set_scheme_of_entry(self, hash: str, scheme_hash: str) -> None:
+        """
+        Only the scheme and not the values (for entries that are already in the postings)
+        """
+        self.scheme_of[hash] = scheme_hash
+        self.entries_of_scheme.setdefault(scheme_hash, set()).add(hash)
+
+    def remove_entry(self, hash: str) -> None:
+        """
+        The postings keep the ordinal, it is skipped until the index is written again
+        """
+        if hash not in self.ordinals:
+            return
+        self.hashes[self.ordinals.pop(hash)] = None
+        if (scheme_hash := self.scheme_of.pop(hash, None)) is not None:
+            self.entries_of_scheme[scheme_hash].discard(hash)
+
+    def set_scheme(self, scheme_hash: str, columns: list[str]) -> None:
+        self.remove_scheme(scheme_hash)
+        self.columns[scheme_hash] = columns
+        for trigram in set().union(*(get_trigrams(i) for i in columns)):
+            self.column_postings.setdefault(trigram, set()).add(scheme_hash)
+
+    def remove_scheme(self, scheme_hash: str) -> None:
+        for trigram in set().union(
+            *(get_trigrams(i) for i in self.columns.pop(scheme_hash, []))
+        ):
+            self.column_postings[trigram].discard(scheme_hash)
+
+    def shortlist(
+        self, query: str, size: int, within: set | None = None
+    ) -> list[str] | None:
+        """
+        The entries (`within` the given ones) sharing the most trigrams with the query
+        (values or column names), None if the query is too short to tell
+        """
+        if len(query.strip()) < 3:
+            return
+        trigrams = get_trigrams(query)
+        counter = Counter()
+        for trigram in trigrams:
+            counter.update(self.postings.get(trigram, ()))
+        shared = {
+            self.hashes[ordinal]: count
+            for ordinal, count in counter.items()
+            if self.hashes[ordinal] is not None
+            and (within is None or self.hashes[ordinal] in within)
+        }
+        schemes = Counter()
+        for trigram in trigrams:
+            schemes.update(self.column_postings.get(trigram, ()))
+        for scheme_hash, count in schemes.items():
+            for hash in self.entries_of_scheme.get(scheme_hash, ()):
+                if within is None or hash in within:
+                    shared[hash] = max(shared.get(hash, 0), count)
+        return nlargest(size, shared, key=shared.get)
+
+    def to_dict(self) -> dict:
+        """
+        The index without the removed entries (schemes are part of the data anyway)
+        """
+        hashes = [hash for hash in self.hashes if hash is not None]
+        new_ordinals = {self.ordinals[hash]: num for num, hash in enumerate(hashes)}
+        postings = {}
+        for trigram, ordinals in self.postings.items():
+            ordinals = sorted(new_ordinals[i] for i in ordinals if i in new_ordinals)
+            if ordinals != []:
+                postings[trigram] = ordinals
+        return {"hashes": hashes, "postings": postings}
+
 
 class Finder:
     def __init__(self):
         pass
 
     @staticmethod
-    def get_best_match_for_each_entry(data: dict, query: str) -> list:
+    def get_choices(
+        data: dict,
+        key: str,
+        get_values: Callable[[str], list[str]] | None = None,
+        index: SearchIndex | None = None,
+    ) -> list[str]:
+        """
+        `get_values` returns the (decoded) values of an entry, without it they are
+        taken from the data as they are
+        """
+        choices = data[key]["values"] if get_values is None else get_values(key)
+        if index is not None:
+            choices = choices + index.columns.get(index.scheme_of.get(key), [])
+        return choices
+
+    @staticmethod
+    def get_best_match_for_each_entry(
+        data: dict,
+        query: str,
+        get_values: Callable[[str], list[str]] | None = None,
+        index: SearchIndex | None = None,
+        min_score=0,
+    ) -> list:
         best_matches = []
-        for key, entry in data.items():
-            best_match = process.extractOne(query, entry["values"])
-            best_matches.append((key, best_match[0], best_match[1]))
+        for key in data:
+            best_match = process.extractOne(
+                query,
+                Finder.get_choices(data, key, get_values, index),
+                score_cutoff=min_score,
+            )
+            if best_match is not None:
+                best_matches.append((key, best_match[0], best_match[1]))
         return best_matches
 
     @staticmethod
-    def fuzzy_search(data: dict, query: str, top_n=5) -> list:
-        best_matches = Finder.get_best_match_for_each_entry(data, query)
-        best_matches.sort(key=lambda x: x[2], reverse=True)
-        return best_matches[:top_n]
+    def fuzzy_search(
+        data: dict,
+        query: str,
+        top_n=5,
+        index: SearchIndex | None = None,
+        get_values: Callable[[str], list[str]] | None = None,
+        min_score=0,
+        workers: int | None = SEARCH_WORKERS,
+        shortlist: list | None = None,
+    ) -> list:
+        """
+        The `top_n` best matches with at least `min_score`. With an index only the
+        entries of its shortlist (unless one is given) are scored, all of them when the
+        query is too short for it or there is no index. Only those scans are big enough
+        to be split across `workers` processes (None for one per core).
+        """
+        if index is not None:
+            if shortlist is None:
+                shortlist = index.shortlist(query, max(SEARCH_SHORTLIST_SIZE, top_n))
+            if shortlist is None:
+                index = None
+            else:
+                data = {key: data[key] for key in shortlist if key in data}
+        items = (
+            (num, key, Finder.get_choices(data, key, get_values, index))
+            for num, key in enumerate(data)
+        )
+        if workers != 1 and len(data) >= PARALLEL_SEARCH_THRESHOLD:
+            heap = Finder.score_in_parallel(
+                query, list(items), top_n, min_score, workers
+            )
+        else:
+            heap = get_top_matches(query, items, top_n, min_score)
+        return [
+            (key, match, score) for score, _, key, match in sorted(heap, reverse=True)
+        ]
+
+    @staticmethod
+    def score_in_parallel(
+        query: str, items: list, top_n: int, min_score: int, workers: int | None
+    ) -> list:
+        """
+        Score shards of the items in a process pool and merge the top matches of them
+        """
+        global pool, pool_size
+        workers = workers or cpu_count() or 1
+        if pool is None or pool_size != workers:
+            if pool is not None:
+                pool.shutdown()
+            pool, pool_size = ProcessPoolExecutor(workers), workers
+        shard_size = -(-len(items) // workers)
+        shards = [
+            pool.submit(
+                get_top_matches, query, items[i : i + shard_size], top_n, min_score
+            )
+            for i in range(0, len(items), shard_size)
+        ]
+        return nlargest(top_n, (i for shard in shards for i in shard.result()))
+
+
+class LiveSearch:
+    """
+    A search that runs again on every change of the query. When the query extends the
+    previous one, only the candidates of the previous query are searched again (unless
+    its shortlist was cut off at the size limit).
+    """
+
+    def __init__(
+        self,
+        data: dict,
+        index: SearchIndex,
+        get_values: Callable[[str], list[str]] | None = None,
+        top_n=5,
+    ) -> None:
+        self.data = data
+        self.index = index
+        self.get_values = get_values
+        self.top_n = top_n
+        self.query: str | None = None
+        self.candidates: set[str] | None = None
+
+    def search(self, query: str) -> list:
+        """
+        The best matches of the query, nothing while it is too short for the index
+        """
+        within = None
+        if self.candidates and query.startswith(self.query):
+            within = self.candidates
+        size = max(SEARCH_SHORTLIST_SIZE, self.top_n)
+        shortlist = self.index.shortlist(query, size, within)
+        if shortlist is None:
+            self.query, self.candidates = None, None
+            return []
+        # a full shortlist left out entries that may match the longer query better
+        self.query = query
+        self.candidates = set(shortlist) if len(shortlist) < size else None
+        return Finder.fuzzy_search(
+            self.data,
+            query,
+            self.top_n,
+            self.index,
+            self.get_values,
+            shortlist=shortlist,
+        )
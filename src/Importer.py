@@ -0,0 +1,211 @@
+from collections.abc import Callable, Iterator
+from csv import reader
+from json import JSONDecodeError, JSONDecoder, loads
+from logging import getLogger
+from os.path import splitext
+from re import compile
+from typing import BinaryIO, TextIO
+from xml.etree.ElementTree import iterparse
+
+from assets import IMPORT_BATCH_SIZE
+from Data_Manager import (
+    Cryptographer,
+    DataManager,
+    convert_pw_to_key,
+    get_hashing_obj,
+    read_frame,
+)
+from Exporter import ARCHIVE_MAGIC, ARCHIVE_VERSION, get_archive_header
+
+logger = getLogger(__name__)
+
+# the fields of a KeePass entry in the order they become columns, other fields follow
+KEEPASS_FIELDS = ["Title", "UserName", "Password", "URL", "Notes"]
+FORMATS = {
+    ".csv": "csv",
+    ".json": "json",
+    ".jsonl": "jsonl",
+    ".xml": "keepass",
+    ".oniguard": "archive",
+}
+# the last two columns of exported entries
+DATE_COLUMNS = ["changedate", "creationdate"]
+WHITESPACE = compile(r"[ \t\n\r]*")
+ITEM_SEPARATOR = compile(r"[ \t\n\r]*,?[ \t\n\r]*")
+
+
+def get_format(path: str, formats: dict[str, str] = FORMATS) -> str:
+    extension = splitext(path)[1].lower()
+    if extension not in formats:
+        raise ValueError(f"Can't tell the format of {path}, please provide it")
+    return formats[extension]
+
+
+def is_export_header(row: list[str]) -> bool:
+    return [i.lower() for i in row[-2:]] == DATE_COLUMNS
+
+
+def read_csv(f: TextIO) -> Iterator[tuple[list[str], list[str]]]:
+    """
+    The rows as `(columns, values)`, the columns are the header row. Empty rows are
+    skipped, in exports (one section per scheme) a header row may follow them.
+    """
+    columns, after_empty_row = None, False
+    for row in reader(f):
+        if not any(row):
+            after_empty_row = True
+            continue
+        if columns is None or (
+            after_empty_row and is_export_header(columns) and is_export_header(row)
+        ):
+            columns, after_empty_row = row, False
+            continue
+        after_empty_row = False
+        row = row[: len(columns)]
+        yield columns, row + [""] * (len(columns) - len(row))
+
+
+def to_row(item) -> tuple[list[str], list[str]]:
+    if not isinstance(item, dict):
+        raise ValueError("Every item of the JSON has to be an object")
+    return list(item), ["" if i is None else str(i) for i in item.values()]
+
+
+def read_json(f: TextIO, chunk_size=1 << 16) -> Iterator[tuple[list[str], list[str]]]:
+    """
+    The objects of a JSON array, decoded one after another while the file is read in
+    chunks
+    """
+    decoder = JSONDecoder()
+    buffer, pos, is_started = "", 0, False
+    while True:
+        pos = (ITEM_SEPARATOR if is_started else WHITESPACE).match(buffer, pos).end()
+        if pos == len(buffer):
+            if (chunk := f.read(chunk_size)) == "":
+                raise ValueError("The JSON array never ends")
+            buffer, pos = chunk, 0
+            continue
+        if not is_started:
+            if buffer[pos] != "[":
+                raise ValueError("The JSON has to be an array of objects")
+            pos, is_started = pos + 1, True
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            item, pos = decoder.raw_decode(buffer, pos)
+        except JSONDecodeError:
+            # the item continues in the next chunk
+            if (chunk := f.read(chunk_size)) == "":
+                raise
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield to_row(item)
+
+
+def read_json_lines(f: TextIO) -> Iterator[tuple[list[str], list[str]]]:
+    for line in f:
+        if line.strip() != "":
+            yield to_row(loads(line))
+
+
+def read_keepass(f: TextIO) -> Iterator[tuple[list[str], list[str]]]:
+    """
+    The entries of a KeePass XML export, old versions of them (History) are skipped.
+    Every entry is dropped from the tree once it was read.
+    """
+    history_depth = 0
+    for event, element in iterparse(f, ("start", "end")):
+        if element.tag == "History":
+            history_depth += 1 if event == "start" else -1
+            continue
+        if event != "end" or element.tag != "Entry":
+            continue
+        if history_depth == 0:
+            fields = {}
+            for string in element.iterfind("String"):
+                fields[string.findtext("Key", "")] = string.findtext("Value", "") or ""
+            columns = [i for i in KEEPASS_FIELDS if i in fields]
+            columns += [i for i in fields if i not in KEEPASS_FIELDS]
+            if any(fields.values()):
+                yield columns, [fields[i] for i in columns]
+        element.clear()
+
+
+def read_archive(f: BinaryIO, password: str) -> Iterator[tuple[list[str], list[str]]]:
+    """
+    The entries of an archive written by `Exporter.write_archive`, decrypted one
+    segment after another
+    """
+    if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+        raise ValueError("The file isn't an export of oniguard")
+    if f.read(1) != ARCHIVE_VERSION:
+        raise ValueError("Unsupported version of the export")
+    salt, settings = read_frame(f), read_frame(f)
+    if salt is None or settings is None:
+        raise ValueError("The export ends too early")
+    crypt = Cryptographer(
+        convert_pw_to_key(get_hashing_obj(salt, loads(settings)), password)
+    )
+    chunks = crypt.decrypt_stream(f, get_archive_header(salt, settings))
+    buffer = b""
+    while True:
+        try:
+            chunk = next(chunks, None)
+        except Exception as e:
+            # wrong password, truncated or corrupted
+            raise ValueError(str(e)) from e
+        if chunk is None:
+            break
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        for line in lines:
+            if line.strip() != b"":
+                yield to_row(loads(line))
+
+
+def read_rows(f: TextIO, format: str) -> Iterator[tuple[list[str], list[str]]]:
+    match format:
+        case "csv":
+            return read_csv(f)
+        case "json":
+            return read_json(f)
+        case "jsonl":
+            return read_json_lines(f)
+        case "keepass":
+            return read_keepass(f)
+    raise ValueError(f"Unknown format {format}")
+
+
+def import_rows(
+    data_manager: DataManager,
+    rows: Iterator[tuple[list[str], list[str]]],
+    progress: Callable[[int], None] | None = None,
+) -> int:
+    """
+    Add the rows to the schemes with the same columns (new schemes are created for the
+    others). Nothing is written, the caller commits all of it at once.
+    """
+    schemes: dict[tuple, str] = {}  # column names -> scheme hash
+    count = 0
+    for columns, values in rows:
+        dates = None
+        if is_export_header(columns):
+            # keep the dates of exported entries
+            columns, values, dates = columns[:-2], values[:-2], values[-2:]
+        key = tuple(i.lower() for i in columns)
+        if key not in schemes:
+            scheme_hash = data_manager.get_scheme_hash_by_columns(columns)
+            if scheme_hash is None:
+                scheme_hash = data_manager.add_scheme(
+                    [
+                        [i, "Password" if "password" in i.lower() else "None"]
+                        for i in columns
+                    ]
+                )
+                logger.info(f"Created a scheme for the columns {', '.join(columns)}")
+            schemes[key] = scheme_hash
+        data_manager.add_entry(schemes[key], values, dates)
+        count += 1
+        if progress is not None and count % IMPORT_BATCH_SIZE == 0:
+            progress(count)
+    return count
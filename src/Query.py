@@ -0,0 +1,196 @@
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Iterator
+from itertools import chain
+from re import fullmatch
+from shlex import split
+
+# fields of the hidden date columns every scheme ends with (Changedate, Creationdate)
+DATE_FIELDS = {"changed": 0, "changedate": 0, "created": 1, "creationdate": 1}
+DATE_REGEX = r"\d{4}(-\d{2}(-\d{2}( \d{2}(:\d{2}(:\d{2}(\.\d+)?)?)?)?)?)?"
+OPERATORS = (">=", "<=", ":", "=", ">", "<")
+# sorts after every character a value can have, so `value + END` ends a prefix range
+END = "\U0010ffff"
+
+
+def parse_query(query: str) -> list[tuple[str | None, str, str]]:
+    """
+    Split a query like `scheme:"Email used" app:git* changed>2025-01-01` into its terms
+    `(field, operator, value)`. Terms without a field match the value of any column.
+    Raises a ValueError for an invalid query.
+    """
+    terms = []
+    for word in split(query):
+        positions = [(word.find(op), op) for op in OPERATORS if word.find(op) > 0]
+        if positions == []:
+            terms.append((None, "=", word.lower()))
+            continue
+        # the first operator wins, on the same position the longer one
+        position, op = min(positions, key=lambda x: (x[0], -len(x[1])))
+        field, value = word[:position].lower(), word[position + len(op) :].lower()
+        if value in ("", "*"):
+            raise ValueError(f"The term {word} has no value")
+        op = "=" if op == ":" else op
+        if field in DATE_FIELDS:
+            if not fullmatch(DATE_REGEX, value.rstrip("*")):
+                raise ValueError(f"{value} is not a date like 2025-01-31")
+            if op == "=" and not value.endswith("*"):
+                value += "*"  # the day (or month, ...) and not the exact time
+        terms.append((field, op, value))
+    return terms
+
+
+def get_range(values: list, op: str, value: str) -> tuple[int, int]:
+    """
+    The slice of the sorted `(value, entry hash)` pairs matching the operator. Values
+    ending with `*` and dates match everything starting with them.
+    """
+    if value.endswith("*"):
+        value = value[:-1]
+    elif op == "=":
+        return (
+            bisect_left(values, value, key=lambda x: x[0]),
+            bisect_right(values, value, key=lambda x: x[0]),
+        )
+    match op:
+        case "=":
+            lo, hi = value, value + END
+        case ">":
+            lo, hi = value + END, None
+        case ">=":
+            lo, hi = value, None
+        case "<":
+            lo, hi = None, value
+        case "<=":
+            lo, hi = None, value + END
+    return (
+        0 if lo is None else bisect_left(values, lo, key=lambda x: x[0]),
+        len(values) if hi is None else bisect_left(values, hi, key=lambda x: x[0]),
+    )
+
+
+def is_match(candidate: str, op: str, value: str) -> bool:
+    if value.endswith("*"):
+        value = value[:-1]
+    elif op == "=":
+        return candidate == value
+    match op:
+        case "=":
+            return candidate.startswith(value)
+        case ">":
+            return candidate > value and not candidate.startswith(value)
+        case ">=":
+            return candidate >= value
+        case "<":
+            return candidate < value
+        case "<=":
+            return candidate < value or candidate.startswith(value)
+
+
+class QueryIndex:
+    """
+    Indexes for structured queries: the entries of every scheme, the sorted values of
+    every column (for exact, prefix and range matches) and the sorted dates.
+    Everything is compared in lower case.
+    """
+
+    def __init__(self) -> None:
+        self.schemes: dict[str, set[str]] = {}  # scheme hash -> entry hashes
+        self.scheme_columns: dict[str, list[str]] = {}  # scheme hash -> column names
+        self.columns: dict[str, list[tuple[str, str]]] = {}  # name -> (value, hash)
+        self.dates: list[list[tuple[str, str]]] = [[], []]  # changed, created
+        # what was indexed of an entry (scheme hash, (column, value) pairs, dates)
+        self.entries: dict[str, tuple[str, list, list]] = {}
+
+    def add_entry(
+        self, hash: str, scheme_hash: str, columns: list[tuple], dates: list[str]
+    ) -> None:
+        self.remove_entry(hash)
+        columns = [(name.lower(), value.lower()) for name, value in columns]
+        self.entries[hash] = (scheme_hash, columns, dates)
+        self.schemes.setdefault(scheme_hash, set()).add(hash)
+        for name, value in columns:
+            insort(self.columns.setdefault(name, []), (value, hash))
+        for values, date in zip(self.dates, dates):
+            insort(values, (date, hash))
+
+    def remove_entry(self, hash: str) -> None:
+        if hash not in self.entries:
+            return
+        scheme_hash, columns, dates = self.entries.pop(hash)
+        self.schemes[scheme_hash].discard(hash)
+        for name, value in columns:
+            values = self.columns[name]
+            del values[bisect_left(values, (value, hash))]
+        for values, date in zip(self.dates, dates):
+            del values[bisect_left(values, (date, hash))]
+
+    def set_scheme(self, scheme_hash: str, columns: list[str]) -> None:
+        self.scheme_columns[scheme_hash] = [i.lower() for i in columns]
+
+    def remove_scheme(self, scheme_hash: str) -> None:
+        self.scheme_columns.pop(scheme_hash, None)
+
+    def get_candidates(self, term: tuple) -> tuple[int, Iterator[str]]:
+        """
+        The amount of entries matching a term and an iterator over them
+        """
+        field, op, value = term
+        if field == "scheme":
+            schemes = [
+                self.schemes.get(scheme_hash, set())
+                for scheme_hash, columns in self.scheme_columns.items()
+                if any(is_match(i, op, value) for i in columns)
+            ]
+            return sum(len(i) for i in schemes), chain.from_iterable(schemes)
+        if field in DATE_FIELDS:
+            lists = [self.dates[DATE_FIELDS[field]]]
+        else:
+            lists = [
+                values
+                for name, values in self.columns.items()
+                if field is None or name.startswith(field)
+            ]
+        ranges = [(values, *get_range(values, op, value)) for values in lists]
+        return sum(hi - lo for _, lo, hi in ranges), (
+            values[i][1] for values, lo, hi in ranges for i in range(lo, hi)
+        )
+
+    def is_entry_match(self, hash: str, term: tuple) -> bool:
+        field, op, value = term
+        scheme_hash, columns, dates = self.entries[hash]
+        if field == "scheme":
+            return any(
+                is_match(i, op, value) for i in self.scheme_columns.get(scheme_hash, [])
+            )
+        if field in DATE_FIELDS:
+            return is_match(dates[DATE_FIELDS[field]], op, value)
+        return any(
+            is_match(candidate, op, value)
+            for name, candidate in columns
+            if field is None or name.startswith(field)
+        )
+
+    def query(self, query: str) -> Iterator[str]:
+        """
+        The hashes of the entries matching all terms of the query (one after another).
+        Raises a ValueError for an invalid query.
+        """
+        return self.stream(parse_query(query))
+
+    def stream(self, terms: list) -> Iterator[str]:
+        """
+        The entries of the most selective term are the candidates, the other terms are
+        only checked on them
+        """
+        if terms == []:
+            return
+        candidates = [self.get_candidates(term) for term in terms]
+        best = min(range(len(terms)), key=lambda i: candidates[i][0])
+        others = terms[:best] + terms[best + 1 :]
+        seen = set()
+        for hash in candidates[best][1]:
+            if hash in seen:
+                continue
+            seen.add(hash)
+            if all(self.is_entry_match(hash, term) for term in others):
+                yield hash
@@ -1,5 +1,7 @@
 from ast import literal_eval
 from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from curses import (
     A_NORMAL,
     A_UNDERLINE,
@@ -7,11 +9,15 @@ from curses import (
     COLOR_BLUE,
     COLOR_GREEN,
     COLOR_RED,
+    KEY_BACKSPACE,
+    KEY_DOWN,
+    KEY_UP,
     cbreak,
     color_pair,
     curs_set,
     echo,
     endwin,
+    error,
     init_pair,
     initscr,
     newpad,
@@ -22,31 +28,36 @@ from curses import (
     use_default_colors,
     window,
 )
+from itertools import cycle
 from logging import getLogger
 from os.path import join
 from random import choice, choices, sample
 from re import match
 from textwrap import wrap
-from time import sleep
+from time import monotonic, sleep
 
 from prettytable import PrettyTable
 from pyperclip import copy
 
 from assets import (
     ASCII_ONI_LOGO,
+    BACKGROUND_POLL_MS,
     CONSTRAINTS,
     FOOTER_TEXT,
     GAME_INTRO,
     HELP_MESSAGE,
+    LIVE_SEARCH_DEBOUNCE_MS,
     NAME_REGEX,
     ONI_ENEMIES,
+    SCROLL_KEYS,
+    SPINNER,
 )
 from Data_Manager import (
     DataManager,
     evaluate_password,
     generate_password,
 )
-from Finder import Finder
+from Finder import LiveSearch
 
 logger = getLogger(__name__)
 
@@ -890,7 +901,6 @@ class PopUp:
             )
 
         while True:
-            sleep(0.01)
             display_menu()
             key = self.screen.getkey()
 
@@ -957,7 +967,6 @@ class PopUp:
             )
 
         while True:
-            sleep(0.01)
             display_menu()
             key = self.screen.getkey()
 
@@ -1018,6 +1027,65 @@ class PopUp:
         self.kill_pop_up()
         return input
 
+    def get_input_live_search(
+        self, message: str, search: Callable[[str], list]
+    ) -> str | None:
+        """
+        Show the results of `search` (pairs of a key and a text) while the query is typed.
+        The search only runs once no key was pressed for LIVE_SEARCH_DEBOUNCE_MS, so the
+        queries in between are skipped. Returns the key of the chosen result or None.
+        """
+        message = self.make_message_fit_width(message, self.dimensions[1] - 2)
+        height_of_msg = len(message.splitlines()) + 1
+        height, width = self.win.getmaxyx()
+        query, results, current_option = "", [], 0
+        is_stale, needs_redraw = False, True
+        while True:
+            if needs_redraw:
+                self.win.erase()
+                self.win.addstr(1, 0, message)
+                self.win.box()
+                self.win.addnstr(height_of_msg, 1, f"> {query}", width - 2)
+                for idx, result in enumerate(results[: height - height_of_msg - 3]):
+                    self.win.addnstr(
+                        height_of_msg + 2 + idx,
+                        1,
+                        result[1],
+                        width - 2,
+                        color_pair(2) if idx == current_option else A_NORMAL,
+                    )
+                self.win.refresh()
+                needs_redraw = False
+
+            # wait for the next key only as long as a search is pending
+            self.screen.timeout(LIVE_SEARCH_DEBOUNCE_MS if is_stale else -1)
+            try:
+                key = self.screen.get_wch()
+            except error:
+                results, current_option = search(query), 0
+                is_stale, needs_redraw = False, True
+                continue
+
+            if key == "\n":
+                if is_stale:
+                    results, current_option, is_stale = search(query), 0, False
+                if results != []:
+                    break
+            elif key == "\x1b":
+                self.kill_pop_up()
+                return
+            elif key == KEY_UP and current_option > 0:
+                current_option -= 1
+            elif key == KEY_DOWN and current_option < len(results) - 1:
+                current_option += 1
+            elif key in (KEY_BACKSPACE, "\x7f", "\b"):
+                query, is_stale = query[:-1], True
+            elif isinstance(key, str) and key.isprintable():
+                query, is_stale = query + key, True
+            needs_redraw = True
+        self.kill_pop_up()
+        return results[current_option][0]
+
     # Helper methods
     @staticmethod
     def make_message_fit_width(message: str, width: int) -> str:
@@ -1046,7 +1114,17 @@ class Renderer:
         self.data = data_mng
         self.running = True
 
-        # DETERMINE THE SIZE OF THE MAIN PAD
+        self.query: str | None = None  # only the entries matching it are displayed
+        self.content = self.data.get_all_entries()
+        self.beautified_content = (
+            self.data.beautify_output(self.content)
+            if beautified_content is None
+            else beautified_content
+        )
+        # the line buffer, only the lines in view are drawn from it
+        self.lines = self.beautified_content.splitlines()
+
+        # DETERMINE THE (VIRTUAL) SIZE OF THE MAIN PAD
         y, x = self.get_main_dimensions()
 
         help_lines = HELP_MESSAGE.splitlines()
@@ -1055,9 +1133,17 @@ class Renderer:
             (y, x),
             (len(help_lines) + 1, max(len(line) for line in help_lines) + 1),
         ]
+        self.main_start_y_x = (2, 0)
+        self.main_end_y_x = (
+            self.window_dimensions[0][0] - 2,
+            self.window_dimensions[0][1] - 1,
+        )
         self.windows = [
             self.screen,  # footer
-            newpad(self.window_dimensions[1][0], self.window_dimensions[1][1]),  # main
+            newpad(
+                self.main_end_y_x[0] - self.main_start_y_x[0] + 1,
+                self.window_dimensions[0][1] + 1,
+            ),  # main, only as big as the part of the screen it is shown on
             newpad(
                 self.window_dimensions[2][0], self.window_dimensions[2][1]
             ),  # help message popup
@@ -1073,18 +1159,15 @@ class Renderer:
         if self.scroll_y < 0:
             self.scroll_y = 0
         self.last_scroll_pos_main_scr = (0, 0)
-        self.main_start_y_x = (2, 0)
-        self.main_end_y_x = (
-            self.window_dimensions[0][0] - 2,
-            self.window_dimensions[0][1] - 1,
-        )
         self.active_window = 1
-        self.content = self.data.get_all_entries()
-        self.beautified_content = (
-            self.data.beautify_output(self.data.get_all_entries())
-            if beautified_content is None
-            else beautified_content
-        )
+        # True while more scroll keys are pending, they are drawn once after the batch
+        self.defer_redraw = False
+        self.needs_redraw = False  # a deferred scroll wasn't drawn yet
+        self.last_input = monotonic()
+        # saves and key derivations run in the background, one after another
+        self.worker = ThreadPoolExecutor(1)
+        self.saves: list[Future] = [self.worker.submit(self.data.write_backup)]
+        self.merge: Future | None = None  # takes over the changes of other sessions
 
         # COLOR STUFF FOR IMPORTANCE
         start_color()
@@ -1114,12 +1197,16 @@ class Renderer:
         self.run_scr()
 
     def kill_scr(self) -> None:
-        self.data.update_data()
-        self.running = False
-        nocbreak()
-        self.screen.keypad(False)
-        echo()
-        endwin()
+        try:
+            self.worker.shutdown()  # waits for the saves that are still running
+            self.data.compact()
+        finally:
+            # the terminal is restored even when the data can't be written
+            self.running = False
+            nocbreak()
+            self.screen.keypad(False)
+            echo()
+            endwin()
 
     def run_scr(self) -> None:
         headline = "OniGuard"
@@ -1133,11 +1220,96 @@ class Renderer:
         self.output_text_to_window(0, headline, 1, x, A_UNDERLINE)
         self.update_scr()
         while self.running:
-            sleep(0.01)  # so program doesn't use 100% cpu
-            key = self.get_input()
-            self.event_handler(key)
+            keys = self.get_input()
+            if keys != [] and self.merge is not None:
+                # the keys work on the data the merge is changing
+                self.wait_for(self.merge)
+            self.check_saves()
+            if keys == []:
+                if 0 < self.data.auto_lock <= monotonic() - self.last_input:
+                    self.lock_procedure()
+                    self.last_input = monotonic()
+                continue
+            self.last_input = monotonic()
+            for num, key in enumerate(keys):
+                if not self.running:
+                    break
+                self.defer_redraw = (
+                    key in SCROLL_KEYS
+                    and num + 1 < len(keys)
+                    and keys[num + 1] in SCROLL_KEYS
+                )
+                self.event_handler(key)
+            self.defer_redraw = False
+            if self.needs_redraw and self.running:
+                # the last key might not have drawn anything, e.g. at the last entry
+                self.scroll_pad(self.active_window)
+
+    def save(self) -> None:
+        """
+        Write the pending changes in the background. A save that didn't start yet takes
+        the newer changes with it.
+        """
+        if any(not i.running() and not i.done() for i in self.saves):
+            return
+        self.saves.append(self.worker.submit(self.data.update_data))
+
+    def check_saves(self) -> None:
+        """
+        Forget the finished saves and tell the user about the ones that failed. Once
+        all are done the changes of other sessions are taken over in the background,
+        the screen is updated when that is done.
+        """
+        if self.merge is not None and self.merge.done():
+            merge, self.merge = self.merge, None
+            if (e := merge.exception()) is not None:
+                logger.critical(
+                    f"Couldn't take over the changes of other sessions: {e}"
+                )
+            elif merge.result() != 0:
+                self.update_contents()
+        is_saved = False
+        for future in [i for i in self.saves if i.done()]:
+            self.saves.remove(future)
+            if (e := future.exception()) is None:
+                is_saved = True
+                continue
+            logger.critical(f"Couldn't save the changes: {e}")
+            PopUp(self.screen).get_input_radio_btn(
+                ["Ok"],
+                f"Couldn't save the changes ({e}). They are saved with the next change or when you quit.",
+            )
+            self.update_scr()
+        if is_saved and self.saves == [] and self.merge is None:
+            self.merge = self.worker.submit(self.data.merge_changes)
+
+    def wait_for(self, future: Future) -> None:
+        """
+        Show a spinner in the top right corner until the future is done
+        """
+        y, x = 0, self.window_dimensions[0][1] - 2
+        for frame in cycle(SPINNER):
+            if wait([future], timeout=BACKGROUND_POLL_MS / 1000).done:
+                break
+            self.output_text_to_window(0, frame, y, x)
+        self.output_text_to_window(0, " ", y, x)
+
+    def run_in_background(self, function: Callable, *args):
+        """
+        Run something slow (like the key derivation) on the worker and wait for it
+        """
+        future = self.worker.submit(function, *args)
+        self.wait_for(future)
+        return future.result()
 
     def scroll_pad(self, pad_id: int) -> None:
+        if self.defer_redraw:
+            self.needs_redraw = True
+            return
+        self.needs_redraw = False
+        if pad_id == 1:
+            self.update_scr()
+            return
         start_y, start_x, end_y, end_x = self.get_coordinates_for_centered_pad(pad_id)
         self.windows[pad_id].refresh(
             self.scroll_y, self.scroll_x, start_y, start_x, end_y, end_x
@@ -1152,12 +1324,11 @@ class Renderer:
                         raise ValueError
                     length_idx, current_idx = (
                         len(self.pointer_idx[1]) - 1,
-                        self.pointer_idx[1].index(self.pointer_idx[0]),
+                        self.data.get_entry_ordinal(self.pointer_idx[0]),
                     )
                     if current_idx + 1 > length_idx:
                         raise ValueError
                     self.pointer_idx[0] = self.pointer_idx[1][current_idx + 1]
-                    self.update_scr()
                     if (
                         abs(
                             self.scroll_y
@@ -1166,6 +1337,7 @@ class Renderer:
                         )
                         <= self.window_dimensions[0][0]
                     ):
+                        self.scroll_pad(self.active_window)
                         return
                     if (
                         self.pointer_idx[1][current_idx + 1] - 1
@@ -1196,12 +1368,11 @@ class Renderer:
                         raise ValueError
                     length_idx, current_idx = (
                         len(self.pointer_idx[1]) - 1,
-                        self.pointer_idx[1].index(self.pointer_idx[0]),
+                        self.data.get_entry_ordinal(self.pointer_idx[0]),
                     )
                     if current_idx - 1 < 0:
                         raise ValueError
                     self.pointer_idx[0] = self.pointer_idx[1][current_idx - 1]
-                    self.update_scr()
                     if (
                         self.pointer_idx[1][current_idx]
                         == self.pointer_idx[1][current_idx - 1] + 1
@@ -1238,13 +1409,13 @@ class Renderer:
                 if self.active_window == 2:
                     return
                 self.add_procedure()
-                self.data.update_data()
+                self.save()
             case "F" | "f":
                 # filter schemes and date stats
                 if self.active_window == 2:
                     return
                 self.filter_procedure()
-                self.data.update_data()
+                self.save()
             case "O" | "o":
                 # order by any column in table pointer is at (if multiple shown)
                 if self.active_window == 2:
@@ -1264,20 +1435,13 @@ class Renderer:
                 if self.active_window == 2:
                     return
                 self.on_item_procedure()
-                self.data.update_data()
+                self.save()
             # Default operations
             case "H" | "h":
                 if self.active_window == 2:
                     self.active_window = 1
                     self.scroll_y, self.scroll_x = self.last_scroll_pos_main_scr
-                    self.windows[1].refresh(
-                        self.scroll_y,
-                        self.scroll_x,
-                        self.main_start_y_x[0],
-                        self.main_start_y_x[1],
-                        self.main_end_y_x[0],
-                        self.main_end_y_x[1],
-                    )
+                    self.update_scr()
                 else:
                     self.active_window = 2
                     self.last_scroll_pos_main_scr = (self.scroll_y, self.scroll_x)
@@ -1400,24 +1564,23 @@ class Renderer:
 
     # Implementations of the main procedures
     def search_procedure(self) -> None:
-        if self.content == {}:
+        if len(self.content) == 0:
             return
-        search_key = PopUp(self.screen).get_input_string(
-            "What are you searching for?", NAME_REGEX
+        live_search = LiveSearch(
+            self.content,
+            self.data.get_search_index(),
+            self.data.get_entry_values,
         )
-        elements = Finder.fuzzy_search(self.content, search_key)
-        content: list = self.data.get_entries_beautified([i[0] for i in elements])
-        self.quick_display(content)
-        options = self.data.get_entries_anonymised_with_hash([i[0] for i in elements])
-        options.insert(0, ["", "Cancel"])
-        idx, _ = PopUp(self.screen).get_input_radio_btn(
-            [str(i[1]) for i in options],
-            "What entry do you want to set the pointer to?",
+        hash = PopUp(self.screen).get_input_live_search(
+            "What are you searching for? Select an entry to set the pointer to it or press ESC to cancel.",
+            lambda query: self.data.get_entries_anonymised_with_hash(
+                [i[0] for i in live_search.search(query)]
+            ),
         )
-        if idx == 0:
+        if hash is None:
             self.update_scr()
             return
-        self.pointer_idx[0] = self.data.get_pointer_idx_by_hash(options[idx][0])
+        self.pointer_idx[0] = self.data.get_pointer_idx_by_hash(hash)
         self.update_contents()
         self.update_scr()
 
@@ -1508,7 +1671,6 @@ class Renderer:
                 if scheme_hash is not None:
                     self.data.add_entry(scheme_hash, entry)
         self.update_contents()
-        self.update_main_dimensions()
         self.update_scr(hard_clear=True)
 
     def change_procedure(self, hash: str, type_of_data_to_change: str) -> None:
@@ -1524,9 +1686,7 @@ class Renderer:
                 choice = PopUp(self.screen).get_input_checkboxes(
                     [
                         i.strip()
-                        for i in self.beautified_content.splitlines()[
-                            self.pointer_idx[0]
-                        ].split("|")
+                        for i in self.lines[self.pointer_idx[0]].split("|")
                         if i != ""
                     ],
                     "What entries do you want to update?",
@@ -1582,17 +1742,21 @@ class Renderer:
                         "Please provide the masterpassword to delete the scheme and all its entries. [Wrong input -> Back to entries]",
                         anonymize_input=True,
                     )
-                    if self.data.is_master_password(password):
+                    if self.run_in_background(self.data.is_master_password, password):
                         self.data.delete_scheme(hash)
                     else:
                         return
         self.update_contents()
-        self.update_main_dimensions()
 
     def filter_procedure(self) -> None:
         # causes problem with pointeridx
         choice, _ = PopUp(self.screen).get_input_radio_btn(
-            ["Cancel", "Show hidden date statistics", "Filter schemes"],
+            [
+                "Cancel",
+                "Show hidden date statistics",
+                "Filter schemes",
+                "Filter entries by a query",
+            ],
             "What do you want to do?",
         )
         match choice:
@@ -1619,6 +1783,20 @@ class Renderer:
                 self.data.set_hidden_schemes(
                     [j[0] for i, j in enumerate(schemes) if i in idx]
                 )
+            case 3:
+                query = PopUp(self.screen).get_input_string(
+                    'Which entries do you want to display? For example `scheme:"Email used" app:git* changed>2025-01-01`. Leave it empty to display all of them.',
+                )
+                try:
+                    # only to find out if the query is valid
+                    self.data.get_entries_by_query(query)
+                except ValueError as e:
+                    PopUp(self.screen).get_input_radio_btn(
+                        ["Ok"], f"The query is not valid: {e}"
+                    )
+                    self.update_scr()
+                    return
+                self.query = query if query.strip() != "" else None
         self.update_contents()
         self.update_scr(hard_clear=True)
 
@@ -1626,13 +1804,14 @@ class Renderer:
         entry_hash = self.data.get_entry_hash_by_pointer_idx(self.pointer_idx)
         if entry_hash is None:
             return
-        password = PopUp(self.screen).get_input_string(
-            "Please provide the masterpassword as the data will be displayed without anonymization.",
-            anonymize_input=True,
-        )
-        if not self.data.is_master_password(password):
-            self.update_scr()
-            return
+        if not self.data.is_unlocked():
+            password = PopUp(self.screen).get_input_string(
+                "Please provide the masterpassword as the data will be displayed without anonymization.",
+                anonymize_input=True,
+            )
+            if not self.run_in_background(self.data.is_master_password, password):
+                self.update_scr()
+                return
         # end of password part
         content: list | None = self.data.get_values_beautified(entry_hash)
         if content is None:
@@ -1672,13 +1851,14 @@ class Renderer:
         entry_hash = self.data.get_entry_hash_by_pointer_idx(self.pointer_idx)
         if entry_hash is None:
             return
-        password = PopUp(self.screen).get_input_string(
-            "Please provide the masterpassword as the data will be displayed without anonymization.",
-            anonymize_input=True,
-        )
-        if not self.data.is_master_password(password):
-            self.update_scr()
-            return
+        if not self.data.is_unlocked():
+            password = PopUp(self.screen).get_input_string(
+                "Please provide the masterpassword as the data will be displayed without anonymization.",
+                anonymize_input=True,
+            )
+            if not self.run_in_background(self.data.is_master_password, password):
+                self.update_scr()
+                return
         options = self.data.get_entry_values(entry_hash)
         if options == []:
             return
@@ -1691,6 +1871,7 @@ class Renderer:
         self.update_scr()
 
     def lock_procedure(self) -> None:
+        self.data.lock()
         win = newwin(self.window_dimensions[0][0], self.window_dimensions[0][1], 0, 0)
         message = PopUp.make_message_fit_width(
             "Press [L] to login again or [Q] to quit.", self.window_dimensions[0][1]
@@ -1726,7 +1907,9 @@ class Renderer:
                     self.screen.move(self.window_dimensions[0][0] - 1, 0)
                     curs_set(1)
                     password = win.getstr(self.window_dimensions[0][0] - 1, 0)
-                    if self.data.is_master_password(password.decode()):
+                    if self.run_in_background(
+                        self.data.is_master_password, password.decode()
+                    ):
                         curs_set(0)
                         break
                     else:
@@ -1760,14 +1943,7 @@ class Renderer:
         )
         _, x = self.get_coordinates_for_centered_text(self.screen, headline)
         self.output_text_to_window(0, headline, 1, x, A_UNDERLINE)
-        self.windows[1].refresh(
-            self.scroll_y,
-            self.scroll_x,
-            self.main_start_y_x[0],
-            self.main_start_y_x[1],
-            self.main_end_y_x[0],
-            self.main_end_y_x[1],
-        )
+        self.update_scr()
 
     def on_item_procedure(self) -> None:
         entry_hash = self.data.get_entry_hash_by_pointer_idx(self.pointer_idx)
@@ -1793,7 +1969,7 @@ class Renderer:
                 self.delete_procedure(
                     entry_hash,
                     "entry",
-                    self.beautified_content.splitlines()[self.pointer_idx[0]],
+                    self.lines[self.pointer_idx[0]],
                 )
             case 4:
                 scheme_hash = self.data.get_scheme_hash_by_entry_hash(entry_hash)
@@ -1810,54 +1986,93 @@ class Renderer:
 
     # update methods
     def update_main_dimensions(self) -> None:
-        y, x = self.get_main_dimensions()
-        del self.window_dimensions[1]
-        self.window_dimensions.insert(1, (y, x))
-        del self.windows[1]
-        self.windows.insert(
-            1, newpad(self.window_dimensions[1][0], self.window_dimensions[1][1])
-        )
+        """
+        Only the size of the content changes, the pad stays as big as the screen
+        """
+        self.window_dimensions[1] = self.get_main_dimensions()
 
     def update_contents(self) -> None:
+        entries = self.data.get_all_entries()
+        if self.query is None:
+            self.content = entries
+        else:
+            self.content = {
+                hash: entries[hash]
+                for hash in self.data.get_entries_by_query(self.query)
+            }
+        # the entry the pointer was on (or the one that took its place) stays selected
+        try:
+            pointer_ordinal = self.data.get_entry_ordinal(self.pointer_idx[0])
+            pointer_entry_hash = self.data.get_entry_hash_by_pointer_idx(
+                self.pointer_idx
+            )
+        except ValueError:
+            pointer_ordinal, pointer_entry_hash = None, None
         self.beautified_content = self.data.beautify_output(self.content)
-        pointer_entry_hash = self.data.get_entry_hash_by_pointer_idx(self.pointer_idx)
+        self.lines = self.beautified_content.splitlines()
+        self.update_main_dimensions()
         self.pointer_idx[1] = self.data.get_idx_of_entries()
         new_pointer_idx = self.data.get_pointer_idx_by_hash(pointer_entry_hash)
+        if new_pointer_idx is None and pointer_ordinal is not None:
+            if self.pointer_idx[1] != []:
+                new_pointer_idx = self.pointer_idx[1][
+                    min(pointer_ordinal, len(self.pointer_idx[1]) - 1)
+                ]
         self.pointer_idx[0] = 3 if new_pointer_idx is None else new_pointer_idx
         self.scroll_y, self.scroll_x = (
             self.pointer_idx[0] - self.window_dimensions[0][0] + 6,
             0,
         )
 
-    def update_scr(self, start_y=1, start_x=0, hard_clear=False) -> None:
+    def update_scr(self, hard_clear=False) -> None:
         """
-        Updates the main screen, which displays the tables
+        Updates the main screen, which displays the tables. Only the lines in view are
+        drawn and the screen is refreshed once.
         """
         if hard_clear:
-            self.windows[1].erase()
+            self.windows[1].clear()
         else:
-            self.windows[1].clrtobot()
-        if len(self.beautified_content.splitlines()) == 1:
-            self.output_text_to_window(
-                1, " " + self.beautified_content, start_y, start_x
-            )
-            return
-        for idx, line in enumerate(self.beautified_content.splitlines()):
-            if idx == self.pointer_idx[0] and self.pointer_idx[0] is not None:
-                line = " > " + line
-                self.output_text_to_window(1, line, start_y, start_x, color_pair(2))
+            self.windows[1].erase()
+        height, width = self.windows[1].getmaxyx()
+        width -= 1  # the last column is never shown, so a full line can be drawn
+        # the first line of the content is one line below the top of the pad
+        first = max(self.scroll_y - 1, 0)
+        for idx in range(first, min(self.scroll_y - 1 + height, len(self.lines))):
+            attributes = A_NORMAL
+            if len(self.lines) == 1:
+                line = " " + self.lines[idx]
+            elif idx == self.pointer_idx[0] and self.pointer_idx[0] is not None:
+                line, attributes = " > " + self.lines[idx], color_pair(2)
             else:
-                line = "   " + line
-                self.output_text_to_window(1, line, start_y, start_x)
-            start_y += 1
+                line = "   " + self.lines[idx]
+            try:
+                self.windows[1].addnstr(
+                    idx + 1 - self.scroll_y,
+                    0,
+                    line[self.scroll_x :],
+                    width,
+                    attributes,
+                )
+            except error:
+                logger.critical("Couldn't print string to window.")
+        self.windows[1].refresh(
+            0,
+            0,
+            self.main_start_y_x[0],
+            self.main_start_y_x[1],
+            self.main_end_y_x[0],
+            self.main_end_y_x[1],
+        )
 
     # Some getter methods
     def get_main_dimensions(self) -> tuple:
-        try:
-            max_dimensions = self.data.get_longest_entry_beautified()
-        except ValueError:
+        """
+        The size the main pad would need to show all lines, at least the screen size
+        """
+        if self.lines == []:
             y, x = self.screen.getmaxyx()
             return y - 3, x
+        max_dimensions = len(self.lines) - 1, max(len(i) for i in self.lines) + 2
         if max_dimensions[0] + 2 > self.screen.getmaxyx()[0] - 3:
             y = max_dimensions[0] + 2
         else:
@@ -1868,11 +2083,27 @@ class Renderer:
             x = self.screen.getmaxyx()[1]
         return y, x
 
-    def get_input(self) -> str | None:
+    def get_input(self) -> list[str]:
+        """
+        Wait for a key (until the screen locks itself or a save is done) and return it
+        with the keys that are pending already, e.g. of a held arrow key
+        """
+        timeouts = []
+        if self.saves != [] or self.merge is not None:
+            timeouts.append(BACKGROUND_POLL_MS)  # to report when they are done
+        if self.data.auto_lock > 0:
+            time_left = self.last_input + self.data.auto_lock - monotonic()
+            timeouts.append(max(int(time_left * 1000), 0))
+        self.screen.timeout(min(timeouts, default=-1))
+        keys = []
         try:
-            return self.screen.getkey()
-        except Exception:
-            return None
+            keys.append(self.screen.getkey())
+            self.screen.timeout(0)
+            while True:
+                keys.append(self.screen.getkey())
+        except error:
+            pass
+        return keys
 
     @staticmethod
     def get_coordinates_for_centered_text(stdscr: window, text: str) -> tuple[int, int]:
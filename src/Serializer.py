@@ -0,0 +1,140 @@
+from json import dumps, loads
+from logging import getLogger
+from struct import Struct
+
+from assets import SERIALIZATION_FORMAT
+
+logger = getLogger(__name__)
+
+# Every serialized record starts with a byte that tells how the rest is encoded.
+# Records written before this existed are plain JSON and start with `{` or `[`.
+JSON_V1 = b"\x01"
+BINARY_V1 = b"\x02"
+
+# Type markers of the binary encoding
+NONE, FALSE, TRUE, INT, FLOAT, STR, LIST, DICT, BIG_INT = range(9)
+
+INT64 = Struct("<q")
+FLOAT64 = Struct("<d")
+UINT32 = Struct("<I")
+
+
+def serialize(data, format=None) -> bytes:
+    """
+    Encode the data in one pass, either as compact JSON or in the binary encoding
+    """
+    match SERIALIZATION_FORMAT if format is None else format:
+        case "json":
+            # no sorted keys, the order of the entries is the order they were added in
+            return JSON_V1 + dumps(
+                data, ensure_ascii=False, separators=(",", ":")
+            ).encode("utf-8")
+        case "binary":
+            buffer = bytearray(BINARY_V1)
+            _encode(data, buffer)
+            return bytes(buffer)
+    logger.critical(f"Unknown serialization format {format}")
+    raise Exception("Unknown serialization format")
+
+
+def deserialize(data: bytes):
+    """
+    Decode data of any (known) version of the formats
+    """
+    match data[:1]:
+        case b"\x01":  # JSON_V1
+            return loads(data[1:])
+        case b"\x02":  # BINARY_V1
+            value, _ = _decode(memoryview(data), 1)
+            return value
+        case b"{" | b"[":
+            return loads(data)
+    logger.critical("The data has an unknown serialization format")
+    raise Exception("Unknown serialization format")
+
+
+def _encode(data, buffer: bytearray) -> None:
+    if data is None:
+        buffer.append(NONE)
+    elif data is True:
+        buffer.append(TRUE)
+    elif data is False:
+        buffer.append(FALSE)
+    elif isinstance(data, int):
+        if -(2**63) <= data < 2**63:
+            buffer.append(INT)
+            buffer += INT64.pack(data)
+        else:
+            buffer.append(BIG_INT)
+            _encode_str(str(data), buffer)
+    elif isinstance(data, float):
+        buffer.append(FLOAT)
+        buffer += FLOAT64.pack(data)
+    elif isinstance(data, str):
+        buffer.append(STR)
+        _encode_str(data, buffer)
+    elif isinstance(data, (list, tuple)):
+        buffer.append(LIST)
+        buffer += UINT32.pack(len(data))
+        for item in data:
+            _encode(item, buffer)
+    elif isinstance(data, dict):
+        buffer.append(DICT)
+        buffer += UINT32.pack(len(data))
+        for key, value in data.items():
+            _encode_str(key, buffer)
+            _encode(value, buffer)
+    else:
+        raise TypeError(f"Can't serialize {type(data).__name__}")
+
+
+def _encode_str(data: str, buffer: bytearray) -> None:
+    encoded = data.encode("utf-8")
+    buffer += UINT32.pack(len(encoded))
+    buffer += encoded
+
+
+def _decode(data: memoryview, offset: int) -> tuple:
+    """
+    Decode the value at `offset` and return it with the offset of the next value
+    """
+    kind = data[offset]
+    offset += 1
+    if kind == NONE:
+        return None, offset
+    if kind == FALSE:
+        return False, offset
+    if kind == TRUE:
+        return True, offset
+    if kind == INT:
+        return INT64.unpack_from(data, offset)[0], offset + INT64.size
+    if kind == FLOAT:
+        return FLOAT64.unpack_from(data, offset)[0], offset + FLOAT64.size
+    if kind == STR:
+        return _decode_str(data, offset)
+    if kind == LIST:
+        length = UINT32.unpack_from(data, offset)[0]
+        offset += UINT32.size
+        items = []
+        for _ in range(length):
+            item, offset = _decode(data, offset)
+            items.append(item)
+        return items, offset
+    if kind == DICT:
+        length = UINT32.unpack_from(data, offset)[0]
+        offset += UINT32.size
+        mapping = {}
+        for _ in range(length):
+            key, offset = _decode_str(data, offset)
+            mapping[key], offset = _decode(data, offset)
+        return mapping, offset
+    if kind == BIG_INT:
+        value, offset = _decode_str(data, offset)
+        return int(value), offset
+    raise ValueError(f"Unknown type marker {kind} at {offset - 1}")
+
+
+def _decode_str(data: memoryview, offset: int) -> tuple[str, int]:
+    length = UINT32.unpack_from(data, offset)[0]
+    offset += UINT32.size
+    return str(data[offset : offset + length], "utf-8"), offset + length
@@ -0,0 +1,72 @@
+from collections.abc import Iterable
+
+from wcwidth import wcswidth
+
+
+def get_width(text: str) -> int:
+    """
+    The columns a text takes up in the terminal (CJK characters and emoji take two),
+    like PrettyTable measures it
+    """
+    if text.isascii():
+        return len(text)
+    return wcswidth(text)
+
+
+def center(text: str, width: int) -> str:
+    """
+    Like `str.center` (and PrettyTable), but for the width the text is displayed with
+    """
+    excess = width - get_width(text)
+    # the extra space of an uneven padding goes where `str.center` puts it
+    left = excess // 2 + (excess & width & 1)
+    return " " * left + text + " " * (excess - left)
+
+
+def get_column_widths(field_names: list[str], rows: Iterable[list[str]]) -> list[int]:
+    """
+    The width of every column (without the padding), in one pass over the rows
+    """
+    widths = [get_width(i) for i in field_names]
+    for row in rows:
+        for num, cell in enumerate(row):
+            width = len(cell) if cell.isascii() else get_width(cell)
+            if width > widths[num]:
+                widths[num] = width
+    return widths
+
+
+def format_border(widths: list[int]) -> str:
+    return "+" + "+".join("-" * (width + 2) for width in widths) + "+"
+
+
+def format_row(cells: list[str], widths: list[int]) -> str:
+    """
+    The cells are centered like `str.center` (and PrettyTable) does it
+    """
+    return (
+        "| "
+        + " | ".join(
+            cell.center(width) if cell.isascii() else center(cell, width)
+            for cell, width in zip(cells, widths)
+        )
+        + " |"
+    )
+
+
+def format_table(field_names: list[str], rows: list[list[str]]) -> list[str]:
+    """
+    The lines of an ASCII grid that looks like the default one of PrettyTable:
+
+    +------+----------+
+    | Site | Password |
+    +------+----------+
+    | mail | ******** |
+    +------+----------+
+    """
+    widths = get_column_widths(field_names, rows)
+    border = format_border(widths)
+    lines = [border, format_row(field_names, widths), border]
+    lines.extend(format_row(row, widths) for row in rows)
+    lines.append(border)
+    return lines
@@ -129,7 +129,7 @@ HELP_MESSAGE = """
  Arrow Keys -> Scroll contents
 
  S -> [S]earch the data
- F -> [F]ilter output data
+ F -> [F]ilter output data (by scheme or a query)
  O -> [O]rder data by a column
  C -> [C]opy data to clipboard (selected entry)
  ENTER -> Do an operation on the selected entry
@@ -156,6 +156,79 @@ DEFAULT_SCHEMES = {
 
 CONSTRAINTS = ["None", "Password", "Truncate", "Hidden"]
 
+KDF_HEADER_VERSION = 1
+
+# the settings of users created before the key derivation became configurable
+DEFAULT_KDF_SETTINGS = {
+    "version": KDF_HEADER_VERSION,
+    "algorithm": "pbkdf2-sha256",
+    "params": {"iterations": 480000},
+}
+
+KDF_ALGORITHMS = ["pbkdf2-sha256", "scrypt", "argon2id"]
+
+# calibration never goes below these (memory_cost of argon2id in KiB)
+MIN_KDF_PARAMS = {
+    "iterations": 100000,
+    "n": 2**14,
+    "time_cost": 2,
+    "memory_cost": 19456,
+}
+
+MAX_SCRYPT_N = 2**20
+
+# how records are encoded before they are encrypted, "json" or "binary" (smaller and faster)
+SERIALIZATION_FORMAT = "json"
+
+# files are encrypted and read in segments of this size (bytes)
+SEGMENT_SIZE = 64 * 1024
+
+# backup generations that are kept (up to twice as many before the old ones are folded)
+BACKUP_GENERATIONS = 10
+
+# entries that are scored when searching with the trigram index
+SEARCH_SHORTLIST_SIZE = 500
+
+# processes scoring a search without the index (None for one per core, 1 to search
+# serially) and the amount of entries from which on it is worth it. Searches with the
+# index score at most SEARCH_SHORTLIST_SIZE entries, so they always run serially.
+SEARCH_WORKERS = 1
+PARALLEL_SEARCH_THRESHOLD = 5000
+
+# milliseconds without a key press before the live search runs
+LIVE_SEARCH_DEBOUNCE_MS = 60
+
+# the subcommands of oniguard.py that run without the terminal interface
+COMMANDS = ("get", "list", "add", "import", "export", "agent", "lock")
+
+# the commands that are answered by the agent when one is running
+AGENT_COMMANDS = ("get", "list", "add")
+
+# the socket of the agent in the folder of the user
+AGENT_SOCKET = ".agent.sock"
+
+# seconds the agent keeps the data unlocked by default (0 until it gets locked)
+AGENT_TTL = 3600
+
+# seconds the agent waits for a client (and a client for the agent)
+AGENT_CLIENT_TIMEOUT = 5
+
+# entries imported between two progress reports
+IMPORT_BATCH_SIZE = 1000
+
+# entries exported between two progress reports
+EXPORT_BATCH_SIZE = 1000
+
+# milliseconds between the checks on the work in the background (saves, key derivation)
+BACKGROUND_POLL_MS = 100
+SPINNER = "|/-\\"
+
+# keys that only scroll, when they pile up only the last one is drawn
+SCROLL_KEYS = ("KEY_UP", "KEY_DOWN", "KEY_LEFT", "KEY_RIGHT")
+
+# records in the journal before a new snapshot is written
+JOURNAL_COMPACTION_THRESHOLD = 1000
+
 FOOTER_TEXT = ["[H]elp", "[Q]uit"]
 
 NAME_REGEX = r"^[\S\s]+$"
@@ -0,0 +1,84 @@
+"""
+Compare the table formatter with PrettyTable on tables like the ones of the main
+screen. Run it from this folder: `python benchmark_table.py [rows ...]`
+"""
+
+from base64 import b64encode
+from sys import argv
+from time import perf_counter
+
+from prettytable import PrettyTable
+
+from Table import format_table
+
+FIELD_NAMES = ["Application", "Username", "Password", "Changedate"]
+# cells whose display width differs from their length (wide and combining characters)
+NON_ASCII_CELLS = [
+    "東京駅",
+    "🔑 key",
+    "Müller",
+    "café",
+    "한국어",
+    "ｗｉｄｅ",
+    "e\u0301t\u00e9",
+    "ß",
+]
+
+
+def get_rows(amount: int) -> list[list[str]]:
+    return [
+        [
+            b64encode(f"application {i}".encode()).decode(),
+            b64encode(f"user{i}@mail.com".encode()).decode(),
+            "*" * 8,
+            "2025-01-01 00:00:00.000000",
+        ]
+        for i in range(amount)
+    ]
+
+
+def get_non_ascii_rows(amount: int) -> list[list[str]]:
+    cells = NON_ASCII_CELLS
+    return [
+        [
+            cells[i % len(cells)] * (i % 3 + 1),
+            f"{cells[(i + 1) % len(cells)]}{i}@mail.com",
+            "*" * 8,
+            "2025-01-01 00:00:00.000000",
+        ]
+        for i in range(amount)
+    ]
+
+
+def with_prettytable(rows: list[list[str]]) -> list[str]:
+    table = PrettyTable()
+    table.field_names = FIELD_NAMES
+    for row in rows:
+        table.add_row(row)
+    return table.__str__().splitlines()
+
+
+def with_formatter(rows: list[list[str]]) -> list[str]:
+    return format_table(FIELD_NAMES, rows)
+
+
+def measure(function, rows: list[list[str]]) -> tuple[float, list[str]]:
+    start = perf_counter()
+    lines = function(rows)
+    return perf_counter() - start, lines
+
+
+if __name__ == "__main__":
+    sizes = [int(i) for i in argv[1:]] or [1_000, 10_000, 100_000]
+    for amount in range(1, 2 * len(NON_ASCII_CELLS)):
+        rows = get_non_ascii_rows(amount)
+        if with_formatter(rows) != with_prettytable(rows):
+            raise Exception("The formatter and PrettyTable disagree on non-ASCII cells")
+    print(f"{'rows':>8} {'PrettyTable':>12} {'Table.py':>12} {'speedup':>8}")
+    for size in sizes:
+        rows = get_rows(size)
+        slow, expected = measure(with_prettytable, rows)
+        fast, lines = measure(with_formatter, rows)
+        if lines != expected:
+            raise Exception("The formatter and PrettyTable disagree")
+        print(f"{size:>8} {slow:>11.3f}s {fast:>11.3f}s {slow / fast:>7.1f}x")
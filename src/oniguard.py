@@ -1,15 +1,64 @@
 # Security packets
 import argparse
+import sys
 from getpass import getpass
 
 # Other packets
-from os import get_terminal_size, makedirs, urandom
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from json import dumps
+from os import (
+    O_RDWR,
+    devnull,
+    dup2,
+    get_terminal_size,
+    makedirs,
+    replace,
+    urandom,
+)
+from os import open as os_open
+
+try:
+    from os import fork, setsid
+except ImportError:
+    fork = setsid = None  # Windows, there is no agent there
 from os.path import exists, join
 from time import sleep
 from shutil import rmtree
-from sys import exit
-from assets import PROGRAM_NAME, DESCR
-from Data_Manager import DataManager, get_hashing_obj, convert_pw_to_key
+from sys import argv, exit, stdin
+from xml.etree.ElementTree import ParseError
+from assets import (
+    AGENT_COMMANDS,
+    AGENT_SOCKET,
+    AGENT_TTL,
+    COMMANDS,
+    DEFAULT_KDF_SETTINGS,
+    DESCR,
+    KDF_ALGORITHMS,
+    PROGRAM_NAME,
+    SEARCH_WORKERS,
+)
+from Data_Manager import (
+    DataManager,
+    calibrate_kdf,
+    convert_pw_to_key,
+    finish_rekey,
+    get_hashing_obj,
+    read_kdf_settings,
+    read_salt,
+    time_key_derivation,
+    write_kdf_settings,
+)
+from Finder import Finder
+from Exporter import FORMATS as EXPORT_FORMATS
+from Exporter import (
+    iter_rows,
+    report_progress,
+    write_archive,
+    write_csv,
+    write_json_lines,
+)
+from Importer import FORMATS, get_format, import_rows, read_archive, read_rows
 from Renderer import Renderer, OniManager
 from logging import shutdown
 from LOGGER import setup_logger
@@ -27,7 +76,9 @@ def ask_yes_no(message: str) -> bool:
         raise Exception("ask_yes_no has an implementation error")
 
 
-def login_procedure(folder_path_cross_platform: str) -> DataManager:
+def login_procedure(
+    folder_path_cross_platform: str, kdf_settings: dict | None = None
+) -> DataManager:
     if not exists(folder_path_cross_platform):
         choice = ask_yes_no(f"Do you want to create a new user {args.username}?")
         if choice:
@@ -36,7 +87,10 @@ def login_procedure(folder_path_cross_platform: str) -> DataManager:
             salt = urandom(16)
             with open(join(folder_path_cross_platform, ".salt"), "wb") as f:
                 f.write(salt)
-            kdf = get_hashing_obj(salt)
+            if kdf_settings is None:
+                kdf_settings = DEFAULT_KDF_SETTINGS
+            write_kdf_settings(folder_path_cross_platform, kdf_settings)
+            kdf = get_hashing_obj(salt, kdf_settings)
             pw = getpass(f"Please provide a master password for {args.username}: ")
             check_pw = getpass(f"Please repeat the password for {args.username}: ")
             if pw != check_pw:
@@ -53,18 +107,341 @@ def login_procedure(folder_path_cross_platform: str) -> DataManager:
             exit()
     else:
         setup_logger(join(folder_path_cross_platform, "oniguard.log"))
-    with open(join(folder_path_cross_platform, ".salt"), "rb") as f:
-        kdf = get_hashing_obj(f.readline())
+        finish_rekey(join(folder_path_cross_platform, f"{args.username}.data"))
+    stored_kdf_settings = read_kdf_settings(folder_path_cross_platform)
+    kdf = get_hashing_obj(read_salt(folder_path_cross_platform), stored_kdf_settings)
     password = getpass(f"Please provide the master password for {args.username}: ")
     try:
         key = convert_pw_to_key(kdf, password)
-        return DataManager(
+        data_manager = DataManager(
             join(folder_path_cross_platform, f"{args.username}.data"), key
         )
     except Exception:
         print("Password not correct")
         sleep(5)
         exit()
+    if kdf_settings is not None and kdf_settings != stored_kdf_settings:
+        print("Encrypting the data with the new key derivation settings ...")
+        data_manager.rekey(password, kdf_settings)
+    return data_manager
+
+
+def open_data(username: str, password_from_stdin: bool) -> DataManager:
+    """
+    Log in without any questions besides the password (or read it from stdin)
+    """
+    folder_path_cross_platform = join("..", "userdata", username)
+    if not exists(folder_path_cross_platform):
+        print(f"There is no user {username}", file=sys.stderr)
+        exit(1)
+    setup_logger(join(folder_path_cross_platform, "oniguard.log"))
+    finish_rekey(join(folder_path_cross_platform, f"{username}.data"))
+    kdf = get_hashing_obj(
+        read_salt(folder_path_cross_platform),
+        read_kdf_settings(folder_path_cross_platform),
+    )
+    if password_from_stdin:
+        password = stdin.readline().rstrip("\n")
+    else:
+        password = getpass(f"Please provide the master password for {username}: ")
+    try:
+        return DataManager(
+            join(folder_path_cross_platform, f"{username}.data"),
+            convert_pw_to_key(kdf, password),
+        )
+    except Exception:
+        print("Password not correct", file=sys.stderr)
+        exit(1)
+
+
+def ask_archive_password(password_from_stdin: bool, repeat: bool) -> str:
+    """
+    The password of an encrypted export, from the next line of stdin if the master
+    password was read from there
+    """
+    if password_from_stdin:
+        return stdin.readline().rstrip("\n")
+    password = getpass("Please provide the password of the export: ")
+    if repeat and getpass("Please repeat the password of the export: ") != password:
+        print("The passwords are not identical.", file=sys.stderr)
+        exit(1)
+    return password
+
+
+def get_columns(data_manager: DataManager, hash: str) -> list[list[str]]:
+    """
+    The columns (name and constraint) of the scheme of an entry without the dates
+    """
+    return data_manager.get_scheme(data_manager.get_scheme_hash_by_entry_hash(hash))
+
+
+def find_entries(data_manager: DataManager, args: argparse.Namespace) -> list[str]:
+    if args.search is not None:
+        matches = Finder.fuzzy_search(
+            data_manager.get_all_entries(),
+            args.search,
+            1,
+            data_manager.get_search_index(),
+            data_manager.get_entry_values,
+            # not sent by scripts that talk to the agent directly
+            workers=getattr(args, "search_workers", SEARCH_WORKERS) or None,
+        )
+        return [i[0] for i in matches]
+    if args.query is not None:
+        try:
+            return list(data_manager.get_entries_by_query(args.query))
+        except ValueError as e:
+            print(f"Invalid query: {e}", file=sys.stderr)
+            exit(2)
+    return list(data_manager.get_all_entries())
+
+
+def get_command(data_manager: DataManager, args: argparse.Namespace) -> None:
+    hashes = find_entries(data_manager, args)
+    if len(hashes) != 1:
+        print(f"{len(hashes)} entries match, there has to be one.", file=sys.stderr)
+        exit(1)
+    columns = [i[0] for i in get_columns(data_manager, hashes[0])]
+    values = data_manager.get_entry_values(hashes[0])
+    if args.column is None:
+        print(dumps(dict(zip(columns, values)), ensure_ascii=False))
+        return
+    names = [i.lower() for i in columns]
+    if args.column.lower() not in names:
+        print(f"The entry has no column {args.column}", file=sys.stderr)
+        exit(1)
+    print(values[names.index(args.column.lower())])
+
+
+def list_command(data_manager: DataManager, args: argparse.Namespace) -> None:
+    """
+    The entries with their constraints applied (passwords are never shown)
+    """
+    entries = []
+    for hash in find_entries(data_manager, args):
+        columns = get_columns(data_manager, hash) + data_manager.hidden_stats
+        values = data_manager.apply_constraints_to_data(
+            list(zip(data_manager.get_entry_values(hash), (i[1] for i in columns)))
+        )[:-2]
+        names = [name for name, constraint in columns[:-2] if constraint != "Hidden"]
+        entries.append((hash, names, [i[0] for i in values]))
+    if args.json:
+        print(
+            dumps(
+                [
+                    {"hash": hash, "values": dict(zip(names, values))}
+                    for hash, names, values in entries
+                ],
+                ensure_ascii=False,
+            )
+        )
+        return
+    for hash, _, values in entries:
+        print(f"{hash}  {' | '.join(values)}")
+
+
+def add_command(data_manager: DataManager, args: argparse.Namespace) -> None:
+    if (scheme_hash := data_manager.get_scheme_hash_by_columns(args.scheme)) is None:
+        print(
+            f"There is no scheme with the columns {', '.join(args.scheme)}",
+            file=sys.stderr,
+        )
+        exit(1)
+    if len(args.values) != len(args.scheme):
+        print(
+            f"The scheme has {len(args.scheme)} columns, got {len(args.values)} values",
+            file=sys.stderr,
+        )
+        exit(1)
+    print(data_manager.add_entry(scheme_hash, list(args.values)))
+    data_manager.update_data()
+    data_manager.merge_changes()
+
+
+def import_command(data_manager: DataManager, args: argparse.Namespace) -> None:
+    """
+    Stream the rows of the file into the data and write all of them at once at the end
+    """
+    progress = lambda count: print(
+        f"\rImported {count} entries", end="", file=sys.stderr
+    )
+    try:
+        format = get_format(args.file) if args.format is None else args.format
+        if format == "archive":
+            password = ask_archive_password(args.password_stdin, False)
+            with open(args.file, "rb") as f:
+                count = import_rows(data_manager, read_archive(f, password), progress)
+        else:
+            with open(args.file, newline="", encoding="utf-8-sig") as f:
+                count = import_rows(data_manager, read_rows(f, format), progress)
+    except (OSError, ValueError, ParseError) as e:
+        print(f"\nCouldn't import {args.file}: {e}", file=sys.stderr)
+        exit(1)
+    print(f"\rImported {count} entries", file=sys.stderr)
+    data_manager.compact()
+
+
+def private_opener(path: str, flags: int) -> int:
+    """
+    Exports are created so only the user can read them
+    """
+    return os_open(path, flags, 0o600)
+
+
+def export_command(data_manager: DataManager, args: argparse.Namespace) -> None:
+    """
+    Write the entries one after another to a new file, it only replaces the given one
+    once all of them were written
+    """
+    try:
+        format = (
+            get_format(args.file, EXPORT_FORMATS)
+            if args.format is None
+            else args.format
+        )
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    rows = report_progress(
+        iter_rows(data_manager),
+        lambda count: print(f"\rExported {count} entries", end="", file=sys.stderr),
+    )
+    tmp_path = args.file + ".tmp"
+    try:
+        if format == "archive":
+            password = ask_archive_password(args.password_stdin, True)
+            settings = read_kdf_settings(join("..", "userdata", args.username))
+            with open(tmp_path, "wb", opener=private_opener) as f:
+                count = write_archive(rows, f, password, settings)
+        else:
+            with open(
+                tmp_path, "w", newline="", encoding="utf-8", opener=private_opener
+            ) as f:
+                if format == "csv":
+                    count = write_csv(rows, f)
+                else:
+                    count = write_json_lines(rows, f)
+        replace(tmp_path, args.file)
+    except OSError as e:
+        print(f"\nCouldn't export to {args.file}: {e}", file=sys.stderr)
+        exit(1)
+    print(f"\rExported {count} entries", file=sys.stderr)
+
+
+def is_agent_supported() -> bool:
+    """
+    The agent forks and listens on a Unix socket, Windows has neither of them
+    """
+    if fork is None:
+        return False
+    from Agent import AF_UNIX
+
+    return AF_UNIX is not None
+
+
+def get_agent_path(username: str) -> str:
+    return join("..", "userdata", username, AGENT_SOCKET)
+
+
+def run_in_agent(data_manager: DataManager, args: argparse.Namespace) -> dict:
+    """
+    Run a command like it would run on its own and send back its output
+    """
+    stdout, stderr = StringIO(), StringIO()
+    code = 0
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            run_on_data(data_manager, args)
+        except SystemExit as e:
+            code = e.code or 0
+    return {"code": code, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+
+def agent_command(data_manager: DataManager, args: argparse.Namespace) -> None:
+    """
+    Keep the data unlocked in a background process. It answers the commands of
+    scripts (only AGENT_COMMANDS, the key never leaves it) until --ttl runs out or it
+    gets locked.
+    """
+
+    def handle(request: dict) -> dict:
+        # saved by the terminal interface or a command without the agent
+        data_manager.merge_changes()
+        match request.get("op"):
+            case "run" if request.get("args", {}).get("command") in AGENT_COMMANDS:
+                return run_in_agent(data_manager, argparse.Namespace(**request["args"]))
+        return {"error": f"Unknown request {request.get('op')}"}
+
+    from Agent import Agent
+
+    try:
+        agent = Agent(get_agent_path(args.username), handle, args.ttl)
+    except Exception as e:
+        print(f"Couldn't start the agent: {e}", file=sys.stderr)
+        exit(1)
+    if (pid := fork()) != 0:
+        print(
+            f"The agent (pid {pid}) keeps {args.username} unlocked"
+            + (f" for {args.ttl} seconds" if args.ttl != 0 else "")
+            + f", lock it with `python oniguard.py lock {args.username}`"
+        )
+        return
+    setsid()
+    null = os_open(devnull, O_RDWR)
+    for fd in range(3):
+        dup2(null, fd)
+    # build the indexes now instead of on the first request
+    data_manager.get_query_index()
+    data_manager.get_search_index()
+    agent.serve()
+
+
+def run_on_data(data_manager: DataManager, args: argparse.Namespace) -> None:
+    match args.command:
+        case "get":
+            get_command(data_manager, args)
+        case "list":
+            list_command(data_manager, args)
+        case "add":
+            add_command(data_manager, args)
+        case "import":
+            import_command(data_manager, args)
+        case "export":
+            export_command(data_manager, args)
+        case "agent":
+            agent_command(data_manager, args)
+
+
+def run_command(args: argparse.Namespace) -> None:
+    """
+    The commands for scripts: one key derivation (none if an agent is running), no
+    terminal interface and at most one write (to the journal)
+    """
+    agent_path = get_agent_path(args.username)
+    if not is_agent_supported():
+        if args.command in ("agent", "lock"):
+            print(
+                "The agent needs Unix sockets, they aren't available on this system",
+                file=sys.stderr,
+            )
+            exit(1)
+        run_on_data(open_data(args.username, args.password_stdin), args)
+        return
+    from Agent import call_agent
+
+    if args.command == "lock":
+        if call_agent(agent_path, {"op": "lock"}) is None:
+            print(f"There is no agent running for {args.username}", file=sys.stderr)
+            exit(1)
+        print(f"Locked the agent of {args.username}")
+        return
+    if args.command in AGENT_COMMANDS:
+        response = call_agent(agent_path, {"op": "run", "args": vars(args)})
+        if response is not None and "error" not in response:
+            print(response["stdout"], end="")
+            print(response["stderr"], end="", file=sys.stderr)
+            exit(response["code"])
+    run_on_data(open_data(args.username, args.password_stdin), args)
 
 
 def main(args: argparse.Namespace) -> None:
@@ -86,8 +463,27 @@ def main(args: argparse.Namespace) -> None:
             print(f"User {args.username} got removed")
         exit()
 
-    data_manager = login_procedure(folder_path_cross_platform)
-    data_manager.write_backup()
+    kdf_settings = None
+    if args.calibrate_kdf is not None:
+        kdf_settings = calibrate_kdf(args.calibrate_kdf, args.kdf_target_ms)
+        print(
+            f"Calibrated {kdf_settings['algorithm']} to {kdf_settings['params']} "
+            f"({time_key_derivation(kdf_settings):.0f} ms on this machine)"
+        )
+
+    data_manager = login_procedure(folder_path_cross_platform, kdf_settings)
+    data_manager.unlock_window = args.unlock_window
+    data_manager.auto_lock = args.lock_after
+    if args.backups:
+        for generation in data_manager.get_backup_generations():
+            manifest = data_manager.read_backup_manifest(generation)
+            print(f"{generation:>6}  {manifest['date']}")
+        exit()
+    if args.restore is not None:
+        if ask_yes_no(f"Do you realy whish to restore the backup {args.restore}?"):
+            data_manager.overwrite_main_data_with_backup(args.restore)
+            print(f"Restored the backup {args.restore}")
+        exit()
     Renderer(data_manager, args.transparent)
     print(
         "Thank you for using OniGuard. If there is any issue with the project open an issue on github [ https://github.com/Testspieler09/oniguard ]"
@@ -97,6 +493,107 @@ def main(args: argparse.Namespace) -> None:
 if __name__ == "__main__":
     from argparse import ArgumentParser, RawDescriptionHelpFormatter
 
+    if argv[1:2] and argv[1] in COMMANDS:
+        parser = ArgumentParser(
+            prog="oniguard.py",
+            description="Use the data of a user from scripts, without the terminal interface.",
+        )
+        subparsers = parser.add_subparsers(dest="command", required=True)
+        get_parser = subparsers.add_parser(
+            "get", help="Print the values (or one of them) of a single entry."
+        )
+        list_parser = subparsers.add_parser(
+            "list", help="Print the entries, their constraints are applied."
+        )
+        add_parser = subparsers.add_parser("add", help="Add an entry to a scheme.")
+        import_parser = subparsers.add_parser(
+            "import",
+            help="Import the entries of a CSV, JSON (array or lines), KeePass XML or exported file.",
+        )
+        export_parser = subparsers.add_parser(
+            "export",
+            help="Export all entries as CSV, JSON lines or an archive with its own password.",
+        )
+        agent_parser = subparsers.add_parser(
+            "agent",
+            help="Keep the data unlocked in the background, get, list and add use it.",
+        )
+        lock_parser = subparsers.add_parser("lock", help="Stop the agent of a user.")
+        lock_parser.add_argument("username", help="The user whose agent is stopped.")
+        for subparser in (
+            get_parser,
+            list_parser,
+            add_parser,
+            import_parser,
+            export_parser,
+            agent_parser,
+        ):
+            subparser.add_argument("username", help="The user whose data is used.")
+            subparser.add_argument(
+                "--password-stdin",
+                action="store_true",
+                help="Read the master password from the first line of stdin.",
+            )
+        for subparser in (get_parser, list_parser):
+            search = subparser.add_mutually_exclusive_group(
+                required=subparser is get_parser
+            )
+            search.add_argument(
+                "-q", "--query", help="The entries matching a query like app:github."
+            )
+            search.add_argument(
+                "-s", "--search", help="The entry that matches this text the best."
+            )
+            subparser.add_argument(
+                "-w",
+                "--search-workers",
+                type=int,
+                default=SEARCH_WORKERS,
+                metavar="N",
+                help="Split a search that doesn't use the index (a text shorter than 3 characters) across N processes, 0 for one per core (default 1). Other searches only score a shortlist and stay serial.",
+            )
+        get_parser.add_argument(
+            "-c", "--column", help="Only print the value of this column."
+        )
+        list_parser.add_argument(
+            "--json", action="store_true", help="Print the entries as JSON."
+        )
+        add_parser.add_argument(
+            "--scheme",
+            nargs="+",
+            required=True,
+            metavar="COLUMN",
+            help="The column names of the scheme.",
+        )
+        add_parser.add_argument(
+            "--values",
+            nargs="+",
+            required=True,
+            metavar="VALUE",
+            help="A value for every column of the scheme.",
+        )
+        import_parser.add_argument("file", help="The file to import.")
+        import_parser.add_argument(
+            "--format",
+            choices=sorted(set(FORMATS.values())),
+            help="The format of the file (by default taken from its extension).",
+        )
+        export_parser.add_argument("file", help="The file to write.")
+        export_parser.add_argument(
+            "--format",
+            choices=sorted(set(EXPORT_FORMATS.values())),
+            help="The format of the file (by default taken from its extension).",
+        )
+        agent_parser.add_argument(
+            "--ttl",
+            type=int,
+            default=AGENT_TTL,
+            metavar="SECONDS",
+            help=f"Lock the data after this many seconds, 0 to wait for `lock` (default {AGENT_TTL}).",
+        )
+        run_command(parser.parse_args())
+        exit()
+
     max_width_ascii_art = max(len(line) for line in PROGRAM_NAME.strip().split("\n"))
     if get_terminal_size().columns < max_width_ascii_art:
         PROGRAM_NAME = "OniGuard"
@@ -118,6 +615,51 @@ if __name__ == "__main__":
     parser.add_argument(
         "-d", "--delete", action="store_true", help="Delete the specified user."
     )
+    parser.add_argument(
+        "-u",
+        "--unlock-window",
+        type=int,
+        default=0,
+        metavar="SECONDS",
+        help="Don't ask for the master password again within this many seconds after it was provided.",
+    )
+    parser.add_argument(
+        "-l",
+        "--lock-after",
+        type=int,
+        default=0,
+        metavar="SECONDS",
+        help="Lock the screen after this many seconds without input (default never).",
+    )
+    parser.add_argument(
+        "-c",
+        "--calibrate-kdf",
+        nargs="?",
+        const="pbkdf2-sha256",
+        choices=KDF_ALGORITHMS,
+        metavar="ALGORITHM",
+        help=f"Benchmark this machine and encrypt the data with a key derivation that takes about --kdf-target-ms. One of {', '.join(KDF_ALGORITHMS)} (default pbkdf2-sha256).",
+    )
+    parser.add_argument(
+        "--kdf-target-ms",
+        type=int,
+        default=250,
+        metavar="MS",
+        help="The time the key derivation should take when calibrating (default 250).",
+    )
+    parser.add_argument(
+        "-b",
+        "--backups",
+        action="store_true",
+        help="List the backups of the specified user.",
+    )
+    parser.add_argument(
+        "-r",
+        "--restore",
+        type=int,
+        metavar="GENERATION",
+        help="Restore the data of the specified user from this backup.",
+    )
     parser.add_argument(
         "-g", "--game", action="store_true", help="Play an oni themed game."
     )